@@ -1,6 +1,8 @@
 //! CLI command implementations.
 
 use std::fs;
+use std::io::{self, BufRead, Write};
+use std::panic;
 
 use nolang_cli::witness;
 
@@ -190,19 +192,16 @@ pub fn disassemble(args: &[String]) -> Result<(), i32> {
     Ok(())
 }
 
-/// Compute FUNC block hashes for a .nol text file.
+/// Compute FUNC block hashes for a .nol text file, or stdin when the path is `-`.
 pub fn hash(args: &[String]) -> Result<(), i32> {
     if args.is_empty() {
         eprintln!("error: hash requires an input file");
-        eprintln!("Usage: nolang hash <input.nol>");
+        eprintln!("Usage: nolang hash <input.nol | ->");
         return Err(1);
     }
 
     let input = &args[0];
-    let text = fs::read_to_string(input).map_err(|e| {
-        eprintln!("error: cannot read '{input}': {e}");
-        1
-    })?;
+    let text = read_text(input)?;
 
     let program = nolang_assembler::assemble(&text).map_err(|e| {
         eprintln!("error: {e}");
@@ -358,34 +357,230 @@ pub fn witness_cmd(args: &[String]) -> Result<(), i32> {
     let results = witness::run_witnesses(&program, func_index, &witnesses);
 
     // Print results
-    let mut pass_count = 0;
-    let total = results.len();
+    let (lines, pass_count) = witness_lines(&results);
+    for line in &lines {
+        println!("{line}");
+    }
 
-    for result in &results {
-        if result.passed {
-            pass_count += 1;
-            println!("PASS witness {}", result.index);
-        } else if let Some(ref error) = result.error {
-            println!("FAIL witness {}: {}", result.index, error);
-        } else {
-            println!(
-                "FAIL witness {}: expected {}, got {}",
-                result.index,
-                result.expected,
-                result
-                    .actual
-                    .as_ref()
-                    .map_or("(none)".to_string(), |v| v.to_string())
-            );
-        }
+    if pass_count == results.len() {
+        Ok(())
+    } else {
+        Err(3)
     }
+}
 
-    println!("{pass_count}/{total} witnesses passed");
+/// Hash-patch, assemble, verify and witness-test a .nol program in one process.
+///
+/// Reads the program text from a file, or stdin when the path is `-`, and
+/// prints one JSON object with the outcome of every stage. Placeholder
+/// HASH values are recomputed in memory and returned under `hashes` (null
+/// if the program fails the structural check) so callers can patch their
+/// copy of the text. Error strings match what `assemble`, `hash`, `verify`
+/// and `witness` print.
+pub fn validate(args: &[String]) -> Result<(), i32> {
+    if args.is_empty() {
+        eprintln!("error: validate requires an input file");
+        eprintln!("Usage: nolang validate <input.nol | -> [--witnesses <file.json>]");
+        return Err(1);
+    }
 
-    if pass_count == total {
+    let input = &args[0];
+    let witness_json = match parse_witnesses_flag(&args[1..])? {
+        Some(path) => Some(fs::read_to_string(&path).map_err(|e| {
+            eprintln!("error: cannot read '{path}': {e}");
+            1
+        })?),
+        None => None,
+    };
+    let text = read_text(input)?;
+
+    let report = validate_program(&text, witness_json.as_deref());
+    println!("{}", report.to_json());
+
+    if !report.assembled {
+        Err(1)
+    } else if !report.verified {
+        Err(2)
+    } else if report.witness_error.is_some() {
+        Err(3)
+    } else {
         Ok(())
+    }
+}
+
+/// Validate programs streamed over stdin, answering each with one JSON line.
+///
+/// Each request line is `{"assembly": "...", "witnesses": "<witness JSON>"}`
+/// (witnesses may be null); each response line is the `validate` report for
+/// it, flushed immediately. One process can then serve a whole batch, so
+/// callers pay process startup once per worker instead of once per program.
+pub fn serve(args: &[String]) -> Result<(), i32> {
+    if !args.is_empty() {
+        eprintln!("error: serve takes no arguments");
+        eprintln!("Usage: nolang serve < requests.jsonl");
+        return Err(1);
+    }
+
+    let mut stdout = io::stdout().lock();
+    for line in io::stdin().lock().lines() {
+        let line = line.map_err(|e| {
+            eprintln!("error: cannot read request: {e}");
+            1
+        })?;
+        if line.trim().is_empty() {
+            continue;
+        }
+
+        let report = match parse_serve_request(&line) {
+            Ok((assembly, witness_json)) => {
+                // A panic in one program must not take down the whole batch
+                panic::catch_unwind(|| validate_program(&assembly, witness_json.as_deref()))
+                    .unwrap_or_else(|_| ValidateReport {
+                        assemble_error: Some("error: internal error while validating".to_string()),
+                        ..ValidateReport::default()
+                    })
+            }
+            Err(msg) => ValidateReport {
+                assemble_error: Some(format!("error: {msg}")),
+                ..ValidateReport::default()
+            },
+        };
+
+        writeln!(stdout, "{}", report.to_json())
+            .and_then(|()| stdout.flush())
+            .map_err(|e| {
+                eprintln!("error: cannot write response: {e}");
+                1
+            })?;
+    }
+
+    Ok(())
+}
+
+/// Parse one `serve` request line into (assembly, witness JSON).
+fn parse_serve_request(line: &str) -> Result<(String, Option<String>), String> {
+    let request = nolang_cli::json::parse(line).map_err(|e| format!("invalid request: {e}"))?;
+    let assembly = request
+        .get("assembly")
+        .and_then(|v| v.as_str())
+        .ok_or_else(|| "invalid request: missing \"assembly\" string".to_string())?;
+    let witness_json = match request.get("witnesses") {
+        None => None,
+        Some(v) if v.is_null() => None,
+        Some(v) => Some(
+            v.as_str()
+                .ok_or_else(|| "invalid request: \"witnesses\" must be a string".to_string())?
+                .to_string(),
+        ),
+    };
+    Ok((assembly.to_string(), witness_json))
+}
+
+/// Run every validation stage on program text, collecting a report.
+fn validate_program(text: &str, witness_json: Option<&str>) -> ValidateReport {
+    let mut report = ValidateReport::default();
+
+    let mut program = match nolang_assembler::assemble(text) {
+        Ok(program) => program,
+        Err(e) => {
+            report.assemble_error = Some(format!("error: {e}"));
+            return report;
+        }
+    };
+    report.assembled = true;
+
+    // Compute every hash on the unpatched instructions, as `hash` does,
+    // then patch them in place of re-assembling the patched text
+    let (ctx, errors) = nolang_verifier::check_structural(&program.instructions);
+    if errors.is_empty() {
+        let patches: Vec<_> = ctx
+            .functions
+            .iter()
+            .filter_map(|func| {
+                func.hash_pc.map(|hash_pc| {
+                    let hash_instr = nolang_verifier::compute_func_hash(
+                        &program.instructions,
+                        func.func_pc,
+                        hash_pc,
+                    );
+                    (hash_pc, hash_instr)
+                })
+            })
+            .collect();
+        let mut hashes = Vec::with_capacity(patches.len());
+        for (hash_pc, hash_instr) in patches {
+            hashes.push(format!(
+                "HASH 0x{:04x} 0x{:04x} 0x{:04x}",
+                hash_instr.arg1, hash_instr.arg2, hash_instr.arg3
+            ));
+            program.instructions[hash_pc] = hash_instr;
+        }
+        report.hashes = Some(hashes);
     } else {
-        Err(3)
+        report.hash_error = Some(error_lines(&errors));
+    }
+
+    match nolang_verifier::verify(&program) {
+        Ok(()) => report.verified = true,
+        Err(errors) => report.verify_error = Some(error_lines(&errors)),
+    }
+
+    // Witnesses run on the assembled program whether or not it verified
+    if let Some(json_str) = witness_json {
+        let parsed = witness::get_function_param_types(&program, 0)
+            .and_then(|param_types| witness::parse_witness_file(json_str, &param_types));
+        match parsed {
+            Ok(witnesses) => {
+                let results = witness::run_witnesses(&program, 0, &witnesses);
+                let (lines, pass_count) = witness_lines(&results);
+                report.witnesses_total = results.len();
+                report.witnesses_ok = pass_count;
+                if pass_count < results.len() {
+                    report.witness_error = Some(lines.join("\n"));
+                }
+            }
+            Err(e) => report.witness_error = Some(format!("error: {e}")),
+        }
+    }
+
+    report
+}
+
+/// Per-stage outcome of `nolang validate`, printed as one JSON object.
+#[derive(Default)]
+struct ValidateReport {
+    assembled: bool,
+    assemble_error: Option<String>,
+    hashes: Option<Vec<String>>,
+    hash_error: Option<String>,
+    verified: bool,
+    verify_error: Option<String>,
+    witnesses_total: usize,
+    witnesses_ok: usize,
+    witness_error: Option<String>,
+}
+
+impl ValidateReport {
+    fn to_json(&self) -> String {
+        let opt = |s: &Option<String>| s.as_deref().map_or("null".to_string(), json_escape);
+        let hashes = self.hashes.as_ref().map_or("null".to_string(), |hashes| {
+            let items: Vec<String> = hashes.iter().map(|h| json_escape(h)).collect();
+            format!("[{}]", items.join(","))
+        });
+        format!(
+            "{{\"assembled\":{},\"assemble_error\":{},\"hashes\":{},\"hash_error\":{},\
+             \"verified\":{},\"verify_error\":{},\"witnesses_total\":{},\"witnesses_ok\":{},\
+             \"witness_error\":{}}}",
+            self.assembled,
+            opt(&self.assemble_error),
+            hashes,
+            opt(&self.hash_error),
+            self.verified,
+            opt(&self.verify_error),
+            self.witnesses_total,
+            self.witnesses_ok,
+            opt(&self.witness_error),
+        )
     }
 }
 
@@ -466,6 +661,19 @@ pub fn generate(args: &[String]) -> Result<(), i32> {
 
 // --- Helpers ---
 
+/// Read a text file, or all of stdin when the path is `-`.
+fn read_text(path: &str) -> Result<String, i32> {
+    let result = if path == "-" {
+        io::read_to_string(io::stdin())
+    } else {
+        fs::read_to_string(path)
+    };
+    result.map_err(|e| {
+        eprintln!("error: cannot read '{path}': {e}");
+        1
+    })
+}
+
 /// Read and decode a .nolb binary file.
 fn read_binary(path: &str) -> Result<nolang_common::Program, i32> {
     let bytes = fs::read(path).map_err(|e| {
@@ -532,6 +740,44 @@ fn parse_witnesses_flag(args: &[String]) -> Result<Option<String>, i32> {
     Ok(None)
 }
 
+/// Format witness results as `witness` prints them: one PASS/FAIL line per
+/// witness and a summary line. Returns the lines and the pass count.
+fn witness_lines(results: &[witness::WitnessResult]) -> (Vec<String>, usize) {
+    let mut lines = Vec::with_capacity(results.len() + 1);
+    let mut pass_count = 0;
+
+    for result in results {
+        if result.passed {
+            pass_count += 1;
+            lines.push(format!("PASS witness {}", result.index));
+        } else if let Some(ref error) = result.error {
+            lines.push(format!("FAIL witness {}: {}", result.index, error));
+        } else {
+            lines.push(format!(
+                "FAIL witness {}: expected {}, got {}",
+                result.index,
+                result.expected,
+                result
+                    .actual
+                    .as_ref()
+                    .map_or("(none)".to_string(), |v| v.to_string())
+            ));
+        }
+    }
+
+    lines.push(format!("{pass_count}/{} witnesses passed", results.len()));
+    (lines, pass_count)
+}
+
+/// Join errors one per line, each prefixed as the CLI prints them.
+fn error_lines<E: std::fmt::Display>(errors: &[E]) -> String {
+    errors
+        .iter()
+        .map(|e| format!("error: {e}"))
+        .collect::<Vec<_>>()
+        .join("\n")
+}
+
 /// Escape a string as a JSON string value (with quotes).
 fn json_escape(s: &str) -> String {
     let mut out = String::with_capacity(s.len() + 2);
@@ -200,7 +200,19 @@ impl<'a> Parser<'a> {
                         Some(b't') => result.push('\t'),
                         Some(b'u') => {
                             // Parse \uXXXX unicode escape
-                            let hex = self.parse_hex_digits(4)?;
+                            let mut hex = self.parse_hex_digits(4)?;
+                            // Characters outside the BMP arrive as a
+                            // \uD800-\uDBFF \uDC00-\uDFFF surrogate pair
+                            if (0xD800..0xDC00).contains(&hex) {
+                                if self.advance() != Some(b'\\') || self.advance() != Some(b'u') {
+                                    return Err(self.error("unpaired surrogate in unicode escape"));
+                                }
+                                let low = self.parse_hex_digits(4)?;
+                                if !(0xDC00..0xE000).contains(&low) {
+                                    return Err(self.error("unpaired surrogate in unicode escape"));
+                                }
+                                hex = 0x10000 + ((hex - 0xD800) << 10) + (low - 0xDC00);
+                            }
                             if let Some(ch) = char::from_u32(hex) {
                                 result.push(ch);
                             } else {
@@ -481,6 +493,18 @@ mod tests {
         assert_eq!(result, JsonValue::String("A".to_string()));
     }
 
+    #[test]
+    fn parse_string_surrogate_pair() {
+        let result = parse(r#""\ud83d\ude00""#).unwrap();
+        assert_eq!(result, JsonValue::String("\u{1F600}".to_string()));
+    }
+
+    #[test]
+    fn parse_string_lone_surrogate_fails() {
+        assert!(parse(r#""\ud83d""#).is_err());
+        assert!(parse(r#""\ude00""#).is_err());
+    }
+
     #[test]
     fn parse_empty_array() {
         let result = parse("[]").unwrap();
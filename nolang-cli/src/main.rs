@@ -27,6 +27,8 @@ fn main() {
         "train" => commands::train(&args[2..]),
         "witness" => commands::witness_cmd(&args[2..]),
         "generate" => commands::generate(&args[2..]),
+        "validate" => commands::validate(&args[2..]),
+        "serve" => commands::serve(&args[2..]),
         "--help" | "-h" | "help" => {
             print_usage();
             process::exit(0);
@@ -52,8 +54,10 @@ fn print_usage() {
     eprintln!("  verify <input.nolb>                     Verify a binary program");
     eprintln!("  run <input.nolb>                        Verify and execute a binary program");
     eprintln!("  disassemble <input.nolb>                Disassemble binary to text");
-    eprintln!("  hash <input.nol>                        Compute FUNC block hashes");
+    eprintln!("  hash <input.nol | ->                    Compute FUNC block hashes (- reads stdin)");
     eprintln!("  train <input.nol> --intent \"desc\"        Generate training pair");
     eprintln!("  witness <prog.nolb> <wit.json> [--func N]  Run witness tests");
     eprintln!("  generate [--output-dir DIR] [--filter PAT]  Generate corpus programs");
+    eprintln!("  validate <input.nol | -> [--witnesses F]  Hash, assemble, verify, witness (JSON)");
+    eprintln!("  serve                                   Validate JSON-line requests from stdin");
 }
@@ -251,6 +251,28 @@ HALT
         .stdout(predicate::str::starts_with("HASH 0x"));
 }
 
+#[test]
+fn hash_reads_stdin() {
+    nolang()
+        .args(["hash", "-"])
+        .write_stdin(
+            "\
+FUNC 1 4
+PARAM I64
+REF 0
+RET
+HASH 0x0000 0x0000 0x0000
+ENDFUNC
+CONST I64 0x0000 0x002a
+CALL 0
+HALT
+",
+        )
+        .assert()
+        .success()
+        .stdout(predicate::str::starts_with("HASH 0x"));
+}
+
 // ---- Train ----
 
 #[test]
@@ -733,6 +755,103 @@ fn train_without_witnesses_still_works() {
     );
 }
 
+// ---- Validate ----
+
+#[test]
+fn validate_patches_hashes_from_stdin() {
+    nolang()
+        .args(["validate", "-"])
+        .write_stdin(
+            "\
+FUNC 1 4
+PARAM I64
+REF 0
+RET
+HASH 0x0000 0x0000 0x0000
+ENDFUNC
+CONST I64 0x0000 0x002a
+CALL 0
+HALT
+",
+        )
+        .assert()
+        .success()
+        .stdout(predicate::str::contains("\"hashes\":[\"HASH 0x"))
+        .stdout(predicate::str::contains("\"verified\":true"));
+}
+
+#[test]
+fn validate_runs_witnesses() {
+    let nol_path = test_program("ex04_simple_function.nol");
+    let witness_path = test_witness("ex04_simple_function.json");
+
+    nolang()
+        .args([
+            "validate",
+            nol_path.to_str().unwrap(),
+            "--witnesses",
+            witness_path.to_str().unwrap(),
+        ])
+        .assert()
+        .success()
+        .stdout(predicate::str::contains("\"witnesses_total\":4,\"witnesses_ok\":4"));
+}
+
+#[test]
+fn validate_reports_assembly_error() {
+    nolang()
+        .args(["validate", "-"])
+        .write_stdin("BOGUS\n")
+        .assert()
+        .failure()
+        .code(1)
+        .stdout(predicate::str::contains("\"assembled\":false"));
+}
+
+#[test]
+fn serve_answers_each_request_line() {
+    let output = nolang()
+        .arg("serve")
+        .write_stdin(
+            "{\"assembly\": \"CONST I64 0x0000 0x002a\\nHALT\\n\", \"witnesses\": null}\n\
+             {\"assembly\": \"BOGUS\\n\"}\n",
+        )
+        .assert()
+        .success()
+        .get_output()
+        .stdout
+        .clone();
+
+    let stdout = String::from_utf8(output).unwrap();
+    let lines: Vec<&str> = stdout.lines().collect();
+    assert_eq!(lines.len(), 2, "one response per request: {stdout}");
+    assert!(lines[0].contains("\"verified\":true"), "{}", lines[0]);
+    assert!(lines[1].contains("\"assembled\":false"), "{}", lines[1]);
+}
+
+#[test]
+fn serve_accepts_non_bmp_characters() {
+    // The same emoji comment as raw UTF-8 and as an escaped surrogate pair
+    let output = nolang()
+        .arg("serve")
+        .write_stdin(
+            "{\"assembly\": \"; \u{1F600}\\nCONST I64 0x0000 0x002a\\nHALT\\n\"}\n\
+             {\"assembly\": \"; \\ud83d\\ude00\\nCONST I64 0x0000 0x002a\\nHALT\\n\"}\n",
+        )
+        .assert()
+        .success()
+        .get_output()
+        .stdout
+        .clone();
+
+    let stdout = String::from_utf8(output).unwrap();
+    let lines: Vec<&str> = stdout.lines().collect();
+    assert_eq!(lines.len(), 2, "one response per request: {stdout}");
+    for line in lines {
+        assert!(line.contains("\"verified\":true"), "{line}");
+    }
+}
+
 // ---- Disassemble roundtrip for all examples ----
 
 #[test]
@@ -20,13 +20,81 @@ Usage:
 """
 
 import argparse
-import json
+import hashlib
+import multiprocessing
+import os
 import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 
+import fastjson
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
 PROJECT_ROOT = ML_ROOT.parent
+CACHE_DIR = ML_ROOT / ".cache"
+
+TRAINING_SPLITS = ["train_7a.jsonl", "val_7a.jsonl", "test_7a.jsonl"]
+
+# Summary labels indexed by failure layer (index 0 unused)
+_LAYER_LABELS = (None, "Syntax", "Verification", "Witness", "Semantic")
+
+# System prompt suffixes for 7a feedback entries, filled per failure
+_SUFFIX_L13 = (
+    "\nA previous attempt produced an error: %s\n"
+    "Generate correct assembly."
+)
+_SUFFIX_L4 = (
+    "\nA previous attempt was syntactically valid but did not match the user's intent.\n"
+    "The incorrect assembly was:\n%s\n"
+    "Generate the correct assembly instead."
+)
+
+
+def _corpus_files(corpus_dir: Path) -> list[str]:
+    """List .nolt files in corpus_dir as sorted string paths.
+
+    Uses os.scandir so names are checked without building a Path or
+    issuing a stat per entry. A missing directory yields no files.
+    """
+    try:
+        with os.scandir(corpus_dir) as it:
+            files = [e.path for e in it if e.name.endswith(".nolt") and e.is_file()]
+    except FileNotFoundError:
+        return []
+    files.sort()
+    return files
+
+
+def _parse_one(corpus_file: str) -> dict[str, str]:
+    """Parse a single .nolt corpus file into an intent → assembly dict.
+
+    Keeps the first occurrence of each intent within the file.
+    """
+    parsed: dict[str, str] = {}
+    with open(corpus_file, "rb") as f:
+        data = f.read()
+    for line_num, line in enumerate(data.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            entry = fastjson.loads(line)
+        except fastjson.JSONDecodeError:
+            print(f"  WARNING: {corpus_file}:{line_num}: invalid JSON", file=sys.stderr)
+            continue
+
+        intent = entry.get("intent", "").strip()
+        assembly = entry.get("assembly", "").strip()
+        if intent and assembly and intent not in parsed:
+            parsed[intent] = assembly
+    return parsed
 
 
 def load_corpus(corpus_dir: Path) -> dict[str, str]:
@@ -34,26 +102,25 @@ def load_corpus(corpus_dir: Path) -> dict[str, str]:
 
     Returns dict mapping normalized intent → assembly.
     If an intent appears multiple times, keeps the first occurrence.
+    Files are parsed in parallel worker processes and merged in sorted
+    file order, so precedence matches a sequential scan. The workers come
+    from a forkserver, since load_reference_index calls this while a
+    thread is reading the splits and forking a threaded process is unsafe.
     """
-    corpus: dict[str, str] = {}
-
-    for corpus_file in sorted(corpus_dir.glob("*.nolt")):
-        with open(corpus_file) as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    entry = json.loads(line)
-                except json.JSONDecodeError:
-                    print(f"  WARNING: {corpus_file}:{line_num}: invalid JSON", file=sys.stderr)
-                    continue
-
-                intent = entry.get("intent", "").strip()
-                assembly = entry.get("assembly", "").strip()
-                if intent and assembly and intent not in corpus:
-                    corpus[intent] = assembly
+    corpus_files = _corpus_files(corpus_dir)
+    if len(corpus_files) > 1:
+        workers = min(len(corpus_files), os.cpu_count() or 1)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("forkserver")
+        ) as executor:
+            results = list(executor.map(_parse_one, corpus_files))
+    else:
+        results = [_parse_one(path) for path in corpus_files]
 
+    corpus: dict[str, str] = {}
+    for parsed in results:
+        for intent, assembly in parsed.items():
+            corpus.setdefault(intent, assembly)
     return corpus
 
 
@@ -63,26 +130,94 @@ def load_training_data(splits_dir: Path) -> dict[str, str]:
     Checks train_7a.jsonl, val_7a.jsonl, test_7a.jsonl.
     """
     refs: dict[str, str] = {}
-    for split in ["train_7a.jsonl", "val_7a.jsonl", "test_7a.jsonl"]:
+    for split in TRAINING_SPLITS:
         path = splits_dir / split
         if not path.exists():
             continue
-        with open(path) as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    entry = json.loads(line)
-                except json.JSONDecodeError:
-                    continue
-                intent = entry.get("intent", "").strip()
-                assembly = entry.get("assembly", "").strip()
-                if intent and assembly and intent not in refs:
-                    refs[intent] = assembly
+        for line in path.read_bytes().splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = fastjson.loads(line)
+            except fastjson.JSONDecodeError:
+                continue
+            intent = entry.get("intent", "").strip()
+            assembly = entry.get("assembly", "").strip()
+            if intent and assembly and intent not in refs:
+                refs[intent] = assembly
     return refs
 
 
+def _index_cache_key(paths: list[str]) -> str:
+    """Hash input file paths, mtimes and sizes into a cache key."""
+    h = hashlib.blake2b(digest_size=16)
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_mtime_ns}:{st.st_size}\n".encode())
+    return h.hexdigest()
+
+
+def load_reference_index(
+    corpus_dir: Path,
+    splits_dir: Path,
+    use_cache: bool = True,
+) -> tuple[dict[str, str], dict[str, str]]:
+    """Load (corpus, training_refs), reusing a cached index when inputs are unchanged.
+
+    The cache lives in ML_ROOT/.cache and is keyed by the path, mtime and size
+    of every corpus and split file, so touching any input forces a rebuild.
+    Stale cache files are removed whenever a new index is written.
+    """
+    inputs = _corpus_files(corpus_dir)
+    for split in TRAINING_SPLITS:
+        split_path = os.path.join(splits_dir, split)
+        if os.path.isfile(split_path):
+            inputs.append(split_path)
+    cache_path = CACHE_DIR / f"corpus_{_index_cache_key(inputs)}.json"
+
+    if use_cache and cache_path.exists():
+        try:
+            cached = fastjson.loads(cache_path.read_bytes())
+            print(f"  Using cached index: {cache_path.name}")
+            return cached["corpus"], cached["training_refs"]
+        except (fastjson.JSONDecodeError, KeyError):
+            print(f"  WARNING: ignoring unreadable cache {cache_path}", file=sys.stderr)
+
+    # Read the training splits on a thread while the corpus worker
+    # processes parse, so split I/O overlaps corpus parsing.
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        splits_future = executor.submit(load_training_data, splits_dir)
+        corpus = load_corpus(corpus_dir)
+        training_refs = splits_future.result()
+
+    if use_cache:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for stale in CACHE_DIR.glob("corpus_*.json"):
+            stale.unlink()
+        cache_path.write_bytes(fastjson.dumps({"corpus": corpus, "training_refs": training_refs}))
+
+    return corpus, training_refs
+
+
+def _intent_key(intent: str) -> int | str:
+    """Key for intent dedup: a 64-bit xxh3 digest when xxhash is available.
+
+    Without xxhash the intent string itself is used.
+    """
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(intent.encode())
+    return intent
+
+
+def iter_failures(path: Path):
+    """Yield parsed failure entries from a JSONL file one line at a time."""
+    with open(path, "rb") as f:
+        for line in f:
+            # The JSON parser skips surrounding whitespace itself
+            if line.strip():
+                yield fastjson.loads(line)
+
+
 def build_7a_entry(failure: dict, reference_assembly: str) -> dict:
     """Build an error-aware SFT entry for 7a (intent → assembly) task.
 
@@ -95,17 +230,10 @@ def build_7a_entry(failure: dict, reference_assembly: str) -> dict:
 
     if layer <= 3:
         # Structural failure — include error context
-        system_suffix = (
-            f"\nA previous attempt produced an error: {error_msg}\n"
-            "Generate correct assembly."
-        )
+        system_suffix = _SUFFIX_L13 % error_msg
     else:
         # Semantic failure — include incorrect assembly as negative example
-        system_suffix = (
-            "\nA previous attempt was syntactically valid but did not match the user's intent.\n"
-            f"The incorrect assembly was:\n{gen_asm}\n"
-            "Generate the correct assembly instead."
-        )
+        system_suffix = _SUFFIX_L4 % gen_asm
 
     return {
         "intent": failure["intent"],
@@ -166,6 +294,10 @@ def main():
         default=ML_ROOT / "data" / "splits" / "feedback_7b.jsonl",
         help="Output path for 7b feedback dataset",
     )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Re-parse corpus and training splits instead of using the cached index",
+    )
     args = parser.parse_args()
 
     if not args.failures.exists():
@@ -175,95 +307,81 @@ def main():
 
     # Load reference assemblies
     print("Loading reference assemblies...")
-    corpus = load_corpus(args.corpus_dir)
-    print(f"  Corpus: {len(corpus)} unique intents")
-
-    # Also check training splits as fallback
+    # Training splits are checked as a fallback for intents not in the corpus
     splits_dir = ML_ROOT / "data" / "splits"
-    training_refs = load_training_data(splits_dir)
+    corpus, training_refs = load_reference_index(
+        args.corpus_dir, splits_dir, use_cache=not args.no_cache
+    )
+    print(f"  Corpus: {len(corpus)} unique intents")
     print(f"  Training splits: {len(training_refs)} unique intents")
 
-    # Merge (corpus takes priority)
-    all_refs = {**training_refs, **corpus}
+    # Merge in place (corpus takes priority)
+    training_refs.update(corpus)
+    all_refs = training_refs
     print(f"  Combined: {len(all_refs)} unique intents")
 
-    # Load failures
-    failures = []
-    with open(args.failures) as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                failures.append(json.loads(line))
-    print(f"\nLoaded {len(failures)} failures")
-
-    if not failures:
-        print("No failures to process. Writing empty output files.")
-        args.output_7a.parent.mkdir(parents=True, exist_ok=True)
-        args.output_7a.write_text("")
-        args.output_7b.parent.mkdir(parents=True, exist_ok=True)
-        args.output_7b.write_text("")
-        return
-
-    # Build feedback entries
-    entries_7a = []
-    entries_7b = []
+    # Build feedback entries, streaming failures in and entries out
+    total = 0
+    count_7a = 0
+    count_7b = 0
+    by_layer: Counter[int] = Counter()
     matched = 0
     unmatched = 0
-    seen_intents: set[str] = set()
-
-    for failure in failures:
-        intent = failure.get("intent", "").strip()
-        if not intent:
-            continue
-
-        # Dedup by intent within this run
-        if intent in seen_intents:
-            continue
-        seen_intents.add(intent)
-
-        # Find reference assembly
-        ref_asm = all_refs.get(intent)
-        if ref_asm is None:
-            unmatched += 1
-            continue
-        matched += 1
-
-        # 7a entry
-        entry_7a = build_7a_entry(failure, ref_asm)
-        entries_7a.append(entry_7a)
-
-        # 7b entry (only for description failures)
-        entry_7b = build_7b_entry(failure)
-        if entry_7b is not None:
-            entries_7b.append(entry_7b)
+    seen_intents: set[int | str] = set()
 
-    # Write outputs
     args.output_7a.parent.mkdir(parents=True, exist_ok=True)
-    with open(args.output_7a, "w") as f:
-        for entry in entries_7a:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-
     args.output_7b.parent.mkdir(parents=True, exist_ok=True)
-    with open(args.output_7b, "w") as f:
-        for entry in entries_7b:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    with ExitStack() as stack:
+        f7a = stack.enter_context(open(args.output_7a, "wb"))
+        f7b = stack.enter_context(open(args.output_7b, "wb"))
+
+        for failure in iter_failures(args.failures):
+            total += 1
+            intent = failure.get("intent", "").strip()
+            if not intent:
+                continue
+
+            # Dedup by intent within this run
+            intent_key = _intent_key(intent)
+            if intent_key in seen_intents:
+                continue
+            seen_intents.add(intent_key)
+
+            # Find reference assembly
+            ref_asm = all_refs.get(intent)
+            if ref_asm is None:
+                unmatched += 1
+                continue
+            matched += 1
+
+            # 7a entry
+            entry_7a = build_7a_entry(failure, ref_asm)
+            f7a.write(fastjson.dumps(entry_7a) + b"\n")
+            count_7a += 1
+            by_layer[entry_7a["failure_layer"]] += 1
+
+            # 7b entry (only for description failures)
+            entry_7b = build_7b_entry(failure)
+            if entry_7b is not None:
+                f7b.write(fastjson.dumps(entry_7b) + b"\n")
+                count_7b += 1
+
+    print(f"\nLoaded {total} failures")
+    if not total:
+        print("No failures to process. Wrote empty output files.")
+        return
 
     # Summary
-    by_layer: dict[int, int] = {}
-    for e in entries_7a:
-        layer = e.get("failure_layer", 0)
-        by_layer[layer] = by_layer.get(layer, 0) + 1
-
     print(f"\nFeedback dataset built:")
     print(f"  Matched with reference: {matched}")
     print(f"  Unmatched (skipped):    {unmatched}")
-    print(f"\n  7a entries: {len(entries_7a)}")
+    print(f"\n  7a entries: {count_7a}")
     for layer in sorted(by_layer):
-        label = {1: "Syntax", 2: "Verification", 3: "Witness", 4: "Semantic"}.get(layer, f"L{layer}")
+        label = _LAYER_LABELS[layer] if 0 < layer < len(_LAYER_LABELS) else f"L{layer}"
         print(f"    Layer {layer} ({label}): {by_layer[layer]}")
-    print(f"  7b entries: {len(entries_7b)}")
+    print(f"  7b entries: {count_7b}")
     print(f"\n  Written to: {args.output_7a}")
-    if entries_7b:
+    if count_7b:
         print(f"  Written to: {args.output_7b}")
 
 
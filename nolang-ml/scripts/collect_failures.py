@@ -21,94 +21,153 @@ Usage:
 
     # Also collect 7b failures (description quality)
     python scripts/collect_failures.py --include-7b
+
+    # Limit the validation worker pool
+    python scripts/collect_failures.py --workers 4
 """
 
 import argparse
-import json
 import sys
 import time
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
 
+import fastjson
+from validate import BatchValidator
+
 SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
 
+# Summary labels indexed by failure layer (index 0 unused)
+_LAYER_LABELS = (None, "Syntax", "Verification", "Witness", "Semantic")
+
+
+@dataclass(slots=True)
+class FailureRecord:
+    """A single collected failure, serialized as one line of failures.jsonl."""
+    intent: str
+    generated_assembly: str
+    failure_layer: int
+    failure_type: str
+    error_message: str
+    source: str
+    timestamp: str
+    generated_description: str | None = None  # 7b failures only
+
+    def to_dict(self) -> dict:
+        d = {
+            "intent": self.intent,
+            "generated_assembly": self.generated_assembly,
+        }
+        if self.generated_description is not None:
+            d["generated_description"] = self.generated_description
+        d["failure_layer"] = self.failure_layer
+        d["failure_type"] = self.failure_type
+        d["error_message"] = self.error_message
+        d["source"] = self.source
+        d["timestamp"] = self.timestamp
+        return d
+
+
+@lru_cache(maxsize=32)
+def _classify(
+    assembled: bool, verified: bool, has_witnesses: bool, witnesses_passed: bool
+) -> tuple[int, str]:
+    """Map the validation outcome flags to (layer, failure_type)."""
+    if not assembled:
+        return 1, "assembly_syntax"
+    if not verified:
+        return 2, "verification"
+    if has_witnesses and not witnesses_passed:
+        return 3, "witness_mismatch"
+    return 0, "success"
+
 
 def classify_validation(validation: dict) -> tuple[int, str]:
     """Classify a validation result into failure layer and type.
 
     Returns (layer, failure_type) or (0, "success") if no failure.
     """
-    if not validation.get("assembled", False):
-        return 1, "assembly_syntax"
-    if not validation.get("verified", False):
-        return 2, "verification"
-    if validation.get("witnesses_total", 0) > 0 and not validation.get("witnesses_passed", False):
-        return 3, "witness_mismatch"
-    return 0, "success"
+    return _classify(
+        bool(validation.get("assembled", False)),
+        bool(validation.get("verified", False)),
+        validation.get("witnesses_total", 0) > 0,
+        bool(validation.get("witnesses_passed", False)),
+    )
+
+
+def format_errors(errors: list[str], layer: int) -> str:
+    """Join validation errors into one message, skipping the join for a single error."""
+    if not errors:
+        return f"Layer {layer} failure"
+    if len(errors) == 1:
+        return errors[0]
+    return "; ".join(errors)
 
 
-def collect_from_generations(gen_path: Path) -> list[dict]:
+def collect_from_generations(gen_path: Path, workers: int | None = None) -> list[FailureRecord]:
     """Collect Layer 1-3 failures from generation results.
 
-    Reads the generations file and runs validation on each entry via
-    the validate module.
+    Reads the generations file and validates every entry through a single
+    BatchValidator pool, so the Rust CLI calls run concurrently.
     """
     if not gen_path.exists():
         print(f"  Generations file not found: {gen_path}", file=sys.stderr)
         return []
 
-    sys.path.insert(0, str(SCRIPT_DIR))
-    from validate import validate_assembly
-
-    failures = []
+    now_ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    entries = []
     total = 0
     skipped = 0
 
-    with open(gen_path) as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entry = json.loads(line)
-            except json.JSONDecodeError:
-                print(f"  WARNING: {gen_path}:{line_num}: invalid JSON", file=sys.stderr)
-                continue
-
-            total += 1
-            gen_asm = entry.get("generated_assembly", "")
-            if not gen_asm:
-                skipped += 1
-                continue
-
-            intent = entry.get("intent", "")
-            witnesses = entry.get("witnesses")
-
-            # Validate through Rust CLI
-            result = validate_assembly(gen_asm, witnesses)
-            layer, failure_type = classify_validation(result.to_dict())
-
-            if layer == 0:
-                # No failure — skip
-                continue
-
-            error_msg = "; ".join(result.errors) if result.errors else f"Layer {layer} failure"
-
-            failures.append({
-                "intent": intent,
-                "generated_assembly": gen_asm,
-                "failure_layer": layer,
-                "failure_type": failure_type,
-                "error_message": error_msg,
-                "source": "eval_7a",
-                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
-            })
+    for line_num, line in enumerate(gen_path.read_bytes().splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            entry = fastjson.loads(line)
+        except fastjson.JSONDecodeError:
+            print(f"  WARNING: {gen_path}:{line_num}: invalid JSON", file=sys.stderr)
+            continue
+
+        total += 1
+        if not entry.get("generated_assembly", ""):
+            skipped += 1
+            continue
+        entries.append(entry)
+
+    # Validate through Rust CLI
+    with BatchValidator(max_workers=workers) as validator:
+        results = validator.validate_many(
+            [(entry["generated_assembly"], entry.get("witnesses")) for entry in entries]
+        )
+
+    failures: list[FailureRecord] = []
+    for entry, result in zip(entries, results):
+        layer, failure_type = classify_validation(result.to_dict())
+
+        if layer == 0:
+            # No failure — skip
+            continue
+
+        error_msg = format_errors(result.errors, layer)
+
+        failures.append(FailureRecord(
+            intent=entry.get("intent", ""),
+            generated_assembly=entry["generated_assembly"],
+            failure_layer=layer,
+            failure_type=failure_type,
+            error_message=error_msg,
+            source="eval_7a",
+            timestamp=now_ts,
+        ))
 
     print(f"  Generations: {total} total, {len(failures)} failures, {skipped} skipped")
     return failures
 
 
-def collect_from_human_feedback(feedback_path: Path) -> list[dict]:
+def collect_from_human_feedback(feedback_path: Path) -> list[FailureRecord]:
     """Collect Layer 4 failures from human feedback.
 
     Reads human_feedback.jsonl and extracts entries where feedback == "n".
@@ -119,59 +178,57 @@ def collect_from_human_feedback(feedback_path: Path) -> list[dict]:
         print(f"  Human feedback file not found: {feedback_path}", file=sys.stderr)
         return []
 
-    failures = []
+    now_ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    failures: list[FailureRecord] = []
     total = 0
     rejected = 0
 
-    with open(feedback_path) as f:
-        for line_num, line in enumerate(f, 1):
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entry = json.loads(line)
-            except json.JSONDecodeError:
-                print(f"  WARNING: {feedback_path}:{line_num}: invalid JSON", file=sys.stderr)
-                continue
-
-            total += 1
-            feedback = entry.get("feedback", "")
-            if feedback != "n":
-                continue
-
-            rejected += 1
-            intent = entry.get("intent", "")
-            gen_asm = entry.get("generated_assembly", "")
-            validation = entry.get("validation", {})
-
-            # Check if the rejection is actually a structural failure
-            layer, failure_type = classify_validation(validation)
-            if layer == 0:
-                # Structurally valid but human rejected → Layer 4
-                layer = 4
-                failure_type = "semantic_mismatch"
-
-            errors = validation.get("errors", [])
-            if layer == 4:
-                error_msg = "Human rejected: assembly does not match intent"
-            else:
-                error_msg = "; ".join(errors) if errors else f"Layer {layer} failure"
-
-            failures.append({
-                "intent": intent,
-                "generated_assembly": gen_asm,
-                "failure_layer": layer,
-                "failure_type": failure_type,
-                "error_message": error_msg,
-                "source": "human_feedback",
-                "timestamp": entry.get("timestamp", time.strftime("%Y-%m-%dT%H:%M:%S")),
-            })
+    for line_num, line in enumerate(feedback_path.read_bytes().splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            entry = fastjson.loads(line)
+        except fastjson.JSONDecodeError:
+            print(f"  WARNING: {feedback_path}:{line_num}: invalid JSON", file=sys.stderr)
+            continue
+
+        total += 1
+        feedback = entry.get("feedback", "")
+        if feedback != "n":
+            continue
+
+        rejected += 1
+        intent = entry.get("intent", "")
+        gen_asm = entry.get("generated_assembly", "")
+        validation = entry.get("validation", {})
+
+        # Check if the rejection is actually a structural failure
+        layer, failure_type = classify_validation(validation)
+        if layer == 0:
+            # Structurally valid but human rejected → Layer 4
+            layer = 4
+            failure_type = "semantic_mismatch"
+
+        if layer == 4:
+            error_msg = "Human rejected: assembly does not match intent"
+        else:
+            error_msg = format_errors(validation.get("errors", []), layer)
+
+        failures.append(FailureRecord(
+            intent=intent,
+            generated_assembly=gen_asm,
+            failure_layer=layer,
+            failure_type=failure_type,
+            error_message=error_msg,
+            source="human_feedback",
+            timestamp=entry.get("timestamp", now_ts),
+        ))
 
     print(f"  Human feedback: {total} total, {rejected} rejected")
     return failures
 
 
-def collect_from_7b_feedback(feedback_path: Path) -> list[dict]:
+def collect_from_7b_feedback(feedback_path: Path) -> list[FailureRecord]:
     """Collect Layer 4 failures for 7b task (description quality).
 
     Human feedback entries where the assembly was valid but the description
@@ -180,68 +237,68 @@ def collect_from_7b_feedback(feedback_path: Path) -> list[dict]:
     if not feedback_path.exists():
         return []
 
-    failures = []
-
-    with open(feedback_path) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                entry = json.loads(line)
-            except json.JSONDecodeError:
-                continue
-
-            if entry.get("feedback") != "n":
-                continue
-
-            validation = entry.get("validation", {})
-            # Only include if assembly was structurally valid
-            if not validation.get("assembled") or not validation.get("verified"):
-                continue
-
-            failures.append({
-                "intent": entry.get("intent", ""),
-                "generated_assembly": entry.get("generated_assembly", ""),
-                "generated_description": entry.get("description", ""),
-                "failure_layer": 4,
-                "failure_type": "description_mismatch",
-                "error_message": "Human rejected: description does not match intent",
-                "source": "human_feedback_7b",
-                "timestamp": entry.get("timestamp", time.strftime("%Y-%m-%dT%H:%M:%S")),
-            })
+    now_ts = time.strftime("%Y-%m-%dT%H:%M:%S")
+    failures: list[FailureRecord] = []
+
+    for line in feedback_path.read_bytes().splitlines():
+        if not line.strip():
+            continue
+        try:
+            entry = fastjson.loads(line)
+        except fastjson.JSONDecodeError:
+            continue
+
+        if entry.get("feedback") != "n":
+            continue
+
+        validation = entry.get("validation", {})
+        # Only include if assembly was structurally valid
+        if not validation.get("assembled") or not validation.get("verified"):
+            continue
+
+        failures.append(FailureRecord(
+            intent=entry.get("intent", ""),
+            generated_assembly=entry.get("generated_assembly", ""),
+            generated_description=entry.get("description", ""),
+            failure_layer=4,
+            failure_type="description_mismatch",
+            error_message="Human rejected: description does not match intent",
+            source="human_feedback_7b",
+            timestamp=entry.get("timestamp", now_ts),
+        ))
 
     if failures:
         print(f"  7b description failures: {len(failures)}")
     return failures
 
 
-def dedup_failures(failures: list[dict]) -> list[dict]:
-    """Deduplicate failures by intent, keeping the most recent."""
-    seen: dict[str, dict] = {}
-    for f in failures:
-        intent = f.get("intent", "")
-        if not intent:
+def dedup_failures(failures: list[FailureRecord]) -> list[FailureRecord]:
+    """Deduplicate failures by intent, keeping the most recent.
+
+    Single pass over the failures: each intent maps to the index and
+    timestamp of its best entry so far, so the winning timestamp is not
+    looked up again on every comparison.
+    """
+    seen: dict[str, tuple[int, str]] = {}
+    for idx, f in enumerate(failures):
+        if not f.intent:
             continue
-        existing = seen.get(intent)
-        if existing is None or f.get("timestamp", "") >= existing.get("timestamp", ""):
-            seen[intent] = f
-    return list(seen.values())
+        intent = sys.intern(f.intent)
+        ts = f.timestamp
+        best = seen.get(intent)
+        if best is None or ts >= best[1]:
+            seen[intent] = (idx, ts)
+    return [failures[idx] for idx, _ in seen.values()]
 
 
-def print_summary(failures: list[dict]):
+def print_summary(failures: list[FailureRecord]):
     """Print a summary of collected failures by layer."""
-    by_layer: dict[int, int] = {}
-    by_source: dict[str, int] = {}
-    for f in failures:
-        layer = f.get("failure_layer", 0)
-        source = f.get("source", "unknown")
-        by_layer[layer] = by_layer.get(layer, 0) + 1
-        by_source[source] = by_source.get(source, 0) + 1
+    by_layer = Counter(f.failure_layer for f in failures)
+    by_source = Counter(f.source for f in failures)
 
     print(f"\nCollected {len(failures)} unique failures:")
     for layer in sorted(by_layer):
-        label = {1: "Syntax", 2: "Verification", 3: "Witness", 4: "Semantic"}.get(layer, f"Layer {layer}")
+        label = _LAYER_LABELS[layer] if 0 < layer < len(_LAYER_LABELS) else f"Layer {layer}"
         print(f"  Layer {layer} ({label}): {by_layer[layer]}")
     print("  By source:")
     for source, count in sorted(by_source.items()):
@@ -271,6 +328,10 @@ def main():
         "--include-7b", action="store_true",
         help="Also collect 7b description failures from human feedback",
     )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Parallel validation workers (default: CPU count)",
+    )
     args = parser.parse_args()
 
     print("Phase 8: Collecting failures...")
@@ -279,7 +340,7 @@ def main():
 
     # Layer 1-3: From generation results
     print("\nSource 1: Generation results")
-    gen_failures = collect_from_generations(args.generations)
+    gen_failures = collect_from_generations(args.generations, workers=args.workers)
     all_failures.extend(gen_failures)
 
     # Layer 1-4: From human feedback
@@ -298,9 +359,9 @@ def main():
 
     # Write output
     args.output.parent.mkdir(parents=True, exist_ok=True)
-    with open(args.output, "w") as f:
+    with open(args.output, "wb") as f:
         for failure in unique_failures:
-            f.write(json.dumps(failure, ensure_ascii=False) + "\n")
+            f.write(fastjson.dumps(failure.to_dict()) + b"\n")
 
     print_summary(unique_failures)
     print(f"\nWritten to: {args.output}")
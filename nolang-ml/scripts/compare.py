@@ -24,25 +24,28 @@ Usage:
 """
 
 import argparse
-import json
 import sys
 import time
 from pathlib import Path
 
+import fastjson
+from validate import validate_assembly
+
 SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
 
 SEPARATOR = "=" * 80
+FLUSH_EVERY = 10
 
 
 def load_test_data(test_path: Path) -> list[dict]:
     """Load test set entries."""
     entries = []
-    with open(test_path) as f:
+    with open(test_path, "rb") as f:
         for line in f:
-            line = line.strip()
-            if line:
-                entries.append(json.loads(line))
+            # The JSON parser skips surrounding whitespace itself
+            if line.strip():
+                entries.append(fastjson.loads(line))
     return entries
 
 
@@ -52,16 +55,16 @@ def load_pre_generated(gen_7a_path: Path | None, desc_7b_path: Path | None):
     desc_7b = {}
 
     if gen_7a_path and gen_7a_path.exists():
-        with open(gen_7a_path) as f:
-            for line in f:
-                entry = json.loads(line.strip())
-                gen_7a[entry["intent"]] = entry.get("generated_assembly", "")
+        gen_7a = {
+            entry["intent"]: entry.get("generated_assembly", "")
+            for entry in map(fastjson.loads, filter(None, gen_7a_path.read_bytes().splitlines()))
+        }
 
     if desc_7b_path and desc_7b_path.exists():
-        with open(desc_7b_path) as f:
-            for line in f:
-                entry = json.loads(line.strip())
-                desc_7b[entry["assembly"]] = entry.get("generated_description", "")
+        desc_7b = {
+            entry["assembly"]: entry.get("generated_description", "")
+            for entry in map(fastjson.loads, filter(None, desc_7b_path.read_bytes().splitlines()))
+        }
 
     return gen_7a, desc_7b
 
@@ -123,8 +126,11 @@ def run_comparison(
     limit: int | None = None,
 ):
     """Run the interactive comparison loop."""
-    sys.path.insert(0, str(SCRIPT_DIR))
-    from validate import validate_assembly
+    # Model-backed generation pulls in torch, so only import it when needed
+    if model_7a is not None:
+        from inference_7a import generate_assembly
+    if model_7b is not None:
+        from inference_7b import generate_description
 
     feedback_path.parent.mkdir(parents=True, exist_ok=True)
 
@@ -134,7 +140,11 @@ def run_comparison(
     skip_count = 0
     reviewed = 0
 
-    with open(feedback_path, "a") as fout:
+    # A human at the terminal gets every answer written immediately; piped
+    # bulk runs flush in batches. Closing the file flushes the remainder,
+    # including when the loop is interrupted.
+    interactive = sys.stdin.isatty()
+    with open(feedback_path, "ab", buffering=64 * 1024) as fout:
         for i, entry in enumerate(test_entries[:total], 1):
             intent = entry["intent"]
 
@@ -142,7 +152,6 @@ def run_comparison(
             if intent in gen_7a:
                 assembly = gen_7a[intent]
             elif model_7a is not None:
-                from inference_7a import generate_assembly
                 assembly = generate_assembly(model_7a, tokenizer_7a, intent, config_7a)
             else:
                 print(f"\n[{i}/{total}] Skipping (no 7a model/generation): {intent[:50]}...")
@@ -169,7 +178,6 @@ def run_comparison(
             if asm_key in desc_7b:
                 description = desc_7b[asm_key]
             elif model_7b is not None:
-                from inference_7b import generate_description
                 description = generate_description(model_7b, tokenizer_7b, assembly, config_7b)
             else:
                 description = "(no 7b model/generation available)"
@@ -201,8 +209,9 @@ def run_comparison(
                 "validation": vr.to_dict(),
                 "feedback": feedback,
             }
-            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
-            fout.flush()
+            fout.write(fastjson.dumps(record) + b"\n")
+            if interactive or reviewed % FLUSH_EVERY == 0:
+                fout.flush()
 
     # Summary
     print(f"\n{SEPARATOR}")
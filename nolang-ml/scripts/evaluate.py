@@ -21,110 +21,166 @@ Usage:
     # Evaluate from pre-generated files
     python scripts/evaluate.py --7a-generations outputs/generations/test_7a.jsonl
     python scripts/evaluate.py --7b-descriptions outputs/descriptions/test_7b.jsonl
+
+    # Score BLEU with sacrebleu on CPU
+    python scripts/evaluate.py --task 7b --bleu-backend sacrebleu
 """
 
 import argparse
-import json
+import re
 import sys
 import time
+from collections import Counter
+from functools import lru_cache
 from pathlib import Path
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
 
-# Lazy imports for metrics (avoid import cost when not needed)
-_nltk_ready = False
+# Sibling scripts are importable when evaluate is imported from a driver too
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
 
+import fastjson
+from validate import BatchValidator
 
-def _ensure_nltk():
-    global _nltk_ready
-    if not _nltk_ready:
-        import nltk
-        try:
-            nltk.data.find("tokenizers/punkt_tab")
-        except LookupError:
-            nltk.download("punkt_tab", quiet=True)
-        _nltk_ready = True
+# HASH lines with any values, for exact-match comparison
+_HASH_RE = re.compile(r"HASH\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+")
 
+# Output buffer for generated JSONL writes
+WRITE_BUFFER_SIZE = 1024 * 1024
 
-def compute_bleu(references: list[str], hypotheses: list[str]) -> float:
-    """Compute corpus BLEU-4 score."""
-    _ensure_nltk()
-    from nltk.translate.bleu_score import SmoothingFunction, corpus_bleu
+# Inference helpers, imported on first use because they pull in torch
+_INFERENCE_CACHE: dict[str, tuple] = {}
 
-    refs = [[ref.split()] for ref in references]
-    hyps = [hyp.split() for hyp in hypotheses]
-    smoothing = SmoothingFunction().method1
-    return corpus_bleu(refs, hyps, smoothing_function=smoothing)
 
+def _lazy_inference_7a() -> tuple:
+    """Return (generate_assembly_batch, load_config, load_model), importing once."""
+    if "7a" not in _INFERENCE_CACHE:
+        from inference_7a import generate_assembly_batch, load_config, load_model
+        _INFERENCE_CACHE["7a"] = (generate_assembly_batch, load_config, load_model)
+    return _INFERENCE_CACHE["7a"]
 
-def compute_rouge_l(references: list[str], hypotheses: list[str]) -> float:
-    """Compute average ROUGE-L F1 score."""
+
+def _lazy_inference_7b() -> tuple:
+    """Return (generate_description_batch, load_config, load_model), importing once."""
+    if "7b" not in _INFERENCE_CACHE:
+        from inference_7b import generate_description_batch, load_config, load_model
+        _INFERENCE_CACHE["7b"] = (generate_description_batch, load_config, load_model)
+    return _INFERENCE_CACHE["7b"]
+
+
+def compute_bleu(references: list[str], hypotheses: list[str], backend: str = "tensor") -> float:
+    """Compute corpus BLEU-4 score in [0, 1].
+
+    The "tensor" backend counts whitespace-word n-grams with torch (on GPU
+    when available). "sacrebleu" is a CPU alternative that tokenizes
+    internally, so its scores are not directly comparable to "tensor".
+    """
+    if backend == "tensor":
+        from tensor_bleu import corpus_bleu_tokens, encode_words
+
+        refs_ids, hyps_ids = encode_words(references, hypotheses)
+        return corpus_bleu_tokens(refs_ids, hyps_ids)
+
+    from sacrebleu.metrics import BLEU
+
+    bleu = BLEU(effective_order=True, smooth_method="exp")
+    return bleu.corpus_score(hypotheses, [references]).score / 100.0
+
+
+@lru_cache(maxsize=None)
+def _rouge_scorer():
+    """Build the ROUGE-L scorer once; rouge_score is imported on first use."""
     from rouge_score import rouge_scorer
 
-    scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=True)
-    scores = []
-    for ref, hyp in zip(references, hypotheses):
-        score = scorer.score(ref, hyp)
-        scores.append(score["rougeL"].fmeasure)
-    return sum(scores) / len(scores) if scores else 0.0
+    return rouge_scorer.RougeScorer(["rougeL"], use_stemmer=True)
 
 
-def evaluate_7a(generations_path: Path) -> dict:
-    """Evaluate 7a generations using the validation pipeline."""
-    sys.path.insert(0, str(SCRIPT_DIR))
-    from validate import validate_assembly
+def _rouge_l_pair(ref: str, hyp: str) -> float:
+    """ROUGE-L F1 for one reference/hypothesis pair."""
+    return _rouge_scorer().score(ref, hyp)["rougeL"].fmeasure
+
+
+def compute_rouge_l(references: list[str], hypotheses: list[str]) -> float:
+    """Compute average ROUGE-L F1 score.
+
+    Each distinct (reference, hypothesis) pair is scored once and weighted
+    by how often it occurs, so repeated outputs are not re-tokenized.
+    """
+    pairs = Counter(zip(references, hypotheses))
+    if not pairs:
+        return 0.0
+    total = sum(_rouge_l_pair(ref, hyp) * n for (ref, hyp), n in pairs.items())
+    return total / pairs.total()
 
+
+def _error_type(err: str) -> str:
+    """Bucket an error message by the text before its first colon."""
+    head, sep, _ = err.partition(":")
+    return head if sep else err[:40]
+
+
+def _normalize_asm(asm: str) -> str:
+    """Strip surrounding whitespace and blank out HASH values."""
+    return _HASH_RE.sub("HASH", asm.strip())
+
+
+def evaluate_7a(generations_path: Path, workers: int | None = None) -> dict:
+    """Evaluate 7a generations using the validation pipeline.
+
+    Validation runs across a BatchValidator worker pool; results come back
+    in input order so progress lines and counts match a sequential run.
+    """
     print("Evaluating 7a (intent → assembly)...")
     print(f"  Reading: {generations_path}")
 
-    entries = []
-    with open(generations_path) as f:
-        for line in f:
-            entries.append(json.loads(line.strip()))
+    entries = [fastjson.loads(line) for line in generations_path.read_bytes().splitlines() if line.strip()]
+
+    # Exact match (ignoring HASH values and whitespace), only where a
+    # reference exists; inference-only files skip normalization entirely
+    has_ref = [entry for entry in entries if entry.get("reference_assembly")]
+    exact_match = sum(
+        _normalize_asm(entry["generated_assembly"]) == _normalize_asm(entry["reference_assembly"])
+        for entry in has_ref
+    )
 
     total = len(entries)
     assembled = 0
     verified = 0
     witness_pass = 0
     witness_total = 0
-    exact_match = 0
-    errors_by_type: dict[str, int] = {}
-
-    for i, entry in enumerate(entries):
-        gen_asm = entry["generated_assembly"]
-        witnesses = entry.get("witnesses")
-
-        print(f"  [{i+1}/{total}] ", end="", flush=True)
-
-        result = validate_assembly(gen_asm, witnesses)
-
-        if result.assembled:
-            assembled += 1
-        if result.verified:
-            verified += 1
-        if witnesses:
-            witness_total += 1
-            if result.witnesses_passed:
-                witness_pass += 1
-
-        # Exact match (ignoring HASH values and whitespace)
-        ref_asm = entry.get("reference_assembly", "")
-        if ref_asm:
-            import re
-            hash_re = re.compile(r"HASH\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+")
-            gen_norm = hash_re.sub("HASH", gen_asm.strip())
-            ref_norm = hash_re.sub("HASH", ref_asm.strip())
-            if gen_norm == ref_norm:
-                exact_match += 1
-
-        # Track error types
-        for err in result.errors:
-            key = err.split(":")[0] if ":" in err else err[:40]
-            errors_by_type[key] = errors_by_type.get(key, 0) + 1
-
-        status = "OK" if result.fully_valid else "FAIL"
-        print(status)
+    errors_counter: Counter[str] = Counter()
+
+    from tqdm import tqdm
+
+    ok = 0
+    with BatchValidator(max_workers=workers) as validator, \
+            tqdm(total=total, unit="program") as progress:
+        results = validator.imap(
+            (entry["generated_assembly"], entry.get("witnesses")) for entry in entries
+        )
+        for i, (entry, result) in enumerate(zip(entries, results)):
+            witnesses = entry.get("witnesses")
+
+            if result.assembled:
+                assembled += 1
+            if result.verified:
+                verified += 1
+            if witnesses:
+                witness_total += 1
+                if result.witnesses_passed:
+                    witness_pass += 1
+
+            # Track error types
+            errors_counter.update(map(_error_type, result.errors))
+
+            if result.fully_valid:
+                ok += 1
+            else:
+                tqdm.write(f"  [{i+1}/{total}] FAIL")
+            progress.set_postfix_str(f"ok={ok} fail={i + 1 - ok}", refresh=False)
+            progress.update()
 
     metrics = {
         "total": total,
@@ -137,13 +193,13 @@ def evaluate_7a(generations_path: Path) -> dict:
         "witness_pass_pct": witness_pass / witness_total * 100 if witness_total else 0,
         "exact_match": exact_match,
         "exact_match_pct": exact_match / total * 100 if total else 0,
-        "error_types": errors_by_type,
+        "error_types": dict(errors_counter),
     }
 
     return metrics
 
 
-def evaluate_7b(descriptions_path: Path) -> dict:
+def evaluate_7b(descriptions_path: Path, bleu_backend: str = "tensor") -> dict:
     """Evaluate 7b descriptions using BLEU and ROUGE."""
     print("Evaluating 7b (assembly → description)...")
     print(f"  Reading: {descriptions_path}")
@@ -151,9 +207,11 @@ def evaluate_7b(descriptions_path: Path) -> dict:
     references = []
     hypotheses = []
 
-    with open(descriptions_path) as f:
+    with open(descriptions_path, "rb") as f:
         for line in f:
-            entry = json.loads(line.strip())
+            if not line.strip():
+                continue
+            entry = fastjson.loads(line)
             ref = entry.get("reference_description", "")
             hyp = entry.get("generated_description", "")
             if ref and hyp:
@@ -165,7 +223,7 @@ def evaluate_7b(descriptions_path: Path) -> dict:
         return {"total": 0, "bleu4": 0.0, "rouge_l": 0.0}
 
     print(f"  Computing metrics on {len(references)} pairs...")
-    bleu = compute_bleu(references, hypotheses)
+    bleu = compute_bleu(references, hypotheses, backend=bleu_backend)
     rouge_l = compute_rouge_l(references, hypotheses)
 
     metrics = {
@@ -177,65 +235,147 @@ def evaluate_7b(descriptions_path: Path) -> dict:
     return metrics
 
 
-def generate_7a_if_needed(test_path: Path, output_path: Path) -> Path:
-    """Generate 7a outputs if not already present."""
+def _shared_base_model(output_7a: Path, output_7b: Path) -> tuple | None:
+    """Load the base model once when both tasks generate from the same base.
+
+    Returns (model, tokenizer), or None if either output already exists or
+    the 7a and 7b configs load different base models.
+    """
+    if output_7a.exists() or output_7b.exists():
+        return None
+    _, load_config_7a, _ = _lazy_inference_7a()
+    _, load_config_7b, _ = _lazy_inference_7b()
+    config_7a = load_config_7a()
+    config_7b = load_config_7b()
+
+    def base_key(config: dict) -> tuple:
+        inf_cfg = config.get("inference", {})
+        return (
+            config["model"]["base"],
+            config["quantization"],
+            inf_cfg.get("attn_implementation", "flash_attention_2"),
+        )
+
+    if base_key(config_7a) != base_key(config_7b):
+        return None
+    from inference_common import load_base_model
+
+    print("7a and 7b share a base model; loading it once")
+    return load_base_model(config_7a)
+
+
+def _detach_adapter(model) -> None:
+    """Strip the LoRA adapter so the base can be reused."""
+    if hasattr(model, "unload"):
+        # PeftModel: restores the original modules on the shared base in place
+        model.unload()
+
+
+def generate_7a_if_needed(
+    test_path: Path,
+    output_path: Path,
+    batch_size: int = 16,
+    base: tuple | None = None,
+) -> Path:
+    """Generate 7a outputs if not already present.
+
+    base is an optional (model, tokenizer) pair from _shared_base_model; the
+    7a adapter is attached to it for generation and removed afterwards.
+    """
     if output_path.exists():
         return output_path
 
     print("Generating 7a outputs (this requires a trained model)...")
-    from inference_7a import generate_assembly, load_config, load_model
+    generate_assembly_batch, load_config, load_model = _lazy_inference_7a()
+    from tqdm import tqdm
 
     config = load_config()
-    model, tokenizer = load_model(config)
+    if base is None:
+        model, tokenizer = load_model(config)
+    else:
+        from inference_common import attach_adapter
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(test_path) as fin, open(output_path, "w") as fout:
-        for line_num, line in enumerate(fin, 1):
-            entry = json.loads(line.strip())
-            intent = entry["intent"]
-            print(f"  [{line_num}] {intent[:50]}...", end=" ", flush=True)
-            gen = generate_assembly(model, tokenizer, intent, config)
-            result = {
-                "intent": intent,
-                "generated_assembly": gen,
-            }
-            if "assembly" in entry:
-                result["reference_assembly"] = entry["assembly"]
-            if "witnesses" in entry:
-                result["witnesses"] = entry["witnesses"]
-            fout.write(json.dumps(result, ensure_ascii=False) + "\n")
-            print("done")
+        model, tokenizer = attach_adapter(base[0], config), base[1]
 
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    entries = [fastjson.loads(line) for line in test_path.read_bytes().splitlines() if line.strip()]
+
+    with open(output_path, "wb", buffering=WRITE_BUFFER_SIZE) as fout, \
+            tqdm(total=len(entries), unit="intent") as progress:
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            gens = generate_assembly_batch(
+                model, tokenizer, [entry["intent"] for entry in batch], config
+            )
+            lines = []
+            for entry, gen in zip(batch, gens):
+                result = {
+                    "intent": entry["intent"],
+                    "generated_assembly": gen,
+                }
+                if "assembly" in entry:
+                    result["reference_assembly"] = entry["assembly"]
+                if "witnesses" in entry:
+                    result["witnesses"] = entry["witnesses"]
+                lines.append(fastjson.dumps(result) + b"\n")
+            fout.write(b"".join(lines))
+            progress.update(len(batch))
+
+    if base is not None:
+        _detach_adapter(model)
     return output_path
 
 
-def generate_7b_if_needed(test_path: Path, output_path: Path) -> Path:
-    """Generate 7b outputs if not already present."""
+def generate_7b_if_needed(
+    test_path: Path,
+    output_path: Path,
+    batch_size: int = 16,
+    base: tuple | None = None,
+) -> Path:
+    """Generate 7b outputs if not already present.
+
+    base is an optional (model, tokenizer) pair from _shared_base_model; the
+    7b adapter is attached to it for generation and removed afterwards.
+    """
     if output_path.exists():
         return output_path
 
     print("Generating 7b outputs (this requires a trained model)...")
-    from inference_7b import generate_description, load_config, load_model
+    generate_description_batch, load_config, load_model = _lazy_inference_7b()
+    from tqdm import tqdm
 
     config = load_config()
-    model, tokenizer = load_model(config)
+    if base is None:
+        model, tokenizer = load_model(config)
+    else:
+        from inference_common import attach_adapter
 
-    output_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(test_path) as fin, open(output_path, "w") as fout:
-        for line_num, line in enumerate(fin, 1):
-            entry = json.loads(line.strip())
-            assembly = entry["assembly"]
-            print(f"  [{line_num}] ...", end=" ", flush=True)
-            desc = generate_description(model, tokenizer, assembly, config)
-            result = {
-                "assembly": assembly,
-                "generated_description": desc,
-            }
-            if "description" in entry:
-                result["reference_description"] = entry["description"]
-            fout.write(json.dumps(result, ensure_ascii=False) + "\n")
-            print("done")
+        model, tokenizer = attach_adapter(base[0], config), base[1]
 
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    entries = [fastjson.loads(line) for line in test_path.read_bytes().splitlines() if line.strip()]
+
+    with open(output_path, "wb", buffering=WRITE_BUFFER_SIZE) as fout, \
+            tqdm(total=len(entries), unit="program") as progress:
+        for start in range(0, len(entries), batch_size):
+            batch = entries[start:start + batch_size]
+            descs = generate_description_batch(
+                model, tokenizer, [entry["assembly"] for entry in batch], config
+            )
+            lines = []
+            for entry, desc in zip(batch, descs):
+                result = {
+                    "assembly": entry["assembly"],
+                    "generated_description": desc,
+                }
+                if "description" in entry:
+                    result["reference_description"] = entry["description"]
+                lines.append(fastjson.dumps(result) + b"\n")
+            fout.write(b"".join(lines))
+            progress.update(len(batch))
+
+    if base is not None:
+        _detach_adapter(model)
     return output_path
 
 
@@ -275,6 +415,12 @@ def main():
     parser.add_argument("--7b-descriptions", type=Path, help="Pre-generated 7b JSONL")
     parser.add_argument("--output", type=Path, default=ML_ROOT / "outputs" / "metrics",
                         help="Directory to save metrics JSON")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Prompts per generate call when generating outputs (default: 16)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Persistent nolang serve processes for 7a validation (default: CPU count)")
+    parser.add_argument("--bleu-backend", choices=["tensor", "sacrebleu"], default="tensor",
+                        help="BLEU implementation: vectorized torch (default) or sacrebleu")
     args = parser.parse_args()
 
     args.output.mkdir(parents=True, exist_ok=True)
@@ -282,27 +428,36 @@ def main():
     metrics_7a = None
     metrics_7b = None
 
+    output_7a = ML_ROOT / "outputs" / "generations" / "test_7a.jsonl"
+    output_7b = ML_ROOT / "outputs" / "descriptions" / "test_7b.jsonl"
+    shared_base = None
+    if (args.task == "both" and args.__dict__["7a_generations"] is None
+            and args.__dict__["7b_descriptions"] is None):
+        shared_base = _shared_base_model(output_7a, output_7b)
+
     if args.task in ("7a", "both"):
         gen_path = args.__dict__["7a_generations"]
         if gen_path is None:
             gen_path = generate_7a_if_needed(
                 ML_ROOT / "data" / "splits" / "test_7a.jsonl",
-                ML_ROOT / "outputs" / "generations" / "test_7a.jsonl",
+                output_7a,
+                batch_size=args.batch_size,
+                base=shared_base,
             )
-        metrics_7a = evaluate_7a(gen_path)
-        with open(args.output / "metrics_7a.json", "w") as f:
-            json.dump(metrics_7a, f, indent=2)
+        metrics_7a = evaluate_7a(gen_path, workers=args.workers)
+        (args.output / "metrics_7a.json").write_bytes(fastjson.dumps(metrics_7a, indent=True))
 
     if args.task in ("7b", "both"):
         desc_path = args.__dict__["7b_descriptions"]
         if desc_path is None:
             desc_path = generate_7b_if_needed(
                 ML_ROOT / "data" / "splits" / "test_7b.jsonl",
-                ML_ROOT / "outputs" / "descriptions" / "test_7b.jsonl",
+                output_7b,
+                batch_size=args.batch_size,
+                base=shared_base,
             )
-        metrics_7b = evaluate_7b(desc_path)
-        with open(args.output / "metrics_7b.json", "w") as f:
-            json.dump(metrics_7b, f, indent=2)
+        metrics_7b = evaluate_7b(desc_path, bleu_backend=args.bleu_backend)
+        (args.output / "metrics_7b.json").write_bytes(fastjson.dumps(metrics_7b, indent=True))
 
     print_report(metrics_7a, metrics_7b)
 
@@ -312,8 +467,7 @@ def main():
         combined["7a"] = metrics_7a
     if metrics_7b:
         combined["7b"] = metrics_7b
-    with open(args.output / "evaluation_report.json", "w") as f:
-        json.dump(combined, f, indent=2)
+    (args.output / "evaluation_report.json").write_bytes(fastjson.dumps(combined, indent=True))
     print(f"\nMetrics saved to: {args.output}")
 
 
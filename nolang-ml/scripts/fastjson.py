@@ -0,0 +1,39 @@
+"""JSON helpers shared by the pipeline scripts.
+
+Uses orjson when it is installed and falls back to the stdlib json module
+otherwise. Both backends accept bytes on input and produce UTF-8 bytes on
+output, so callers read and write JSONL through binary file handles.
+
+Usage:
+    import fastjson
+    entry = fastjson.loads(line)
+    fout.write(fastjson.dumps(entry) + b"\\n")
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson.JSONDecodeError subclasses json.JSONDecodeError, so a single
+# except clause covers both backends.
+JSONDecodeError = json.JSONDecodeError
+
+
+if orjson is not None:
+    loads = orjson.loads
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        """Serialize obj to UTF-8 JSON bytes, compact or with 2-space indent."""
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else None)
+
+else:
+    loads = json.loads
+
+    def dumps(obj, indent: bool = False) -> bytes:
+        """Serialize obj to UTF-8 JSON bytes, compact or with 2-space indent."""
+        if indent:
+            return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
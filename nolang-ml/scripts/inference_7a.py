@@ -10,22 +10,23 @@ Usage:
     # Batch from file
     python scripts/inference_7a.py --input data/splits/test_7a.jsonl --output outputs/generations/test_7a.jsonl
 
+    # Batch with a larger generation batch size
+    python scripts/inference_7a.py --input data/splits/test_7a.jsonl --output outputs/generations/test_7a.jsonl --batch-size 32
+
     # Interactive mode
     python scripts/inference_7a.py --interactive
 """
 
 import argparse
-import json
 import sys
 from pathlib import Path
 
 import torch
 import yaml
-from peft import PeftModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from tqdm import tqdm
 
-SCRIPT_DIR = Path(__file__).resolve().parent
-ML_ROOT = SCRIPT_DIR.parent
+import fastjson
+from inference_common import ML_ROOT, load_model, render_messages, to_device
 
 SYSTEM_PROMPT = (
     "You are a NoLang code generator. NoLang uses fixed 64-bit instructions, "
@@ -34,6 +35,9 @@ SYSTEM_PROMPT = (
     "Generate syntactically correct NoLang assembly for the given intent."
 )
 
+# Output buffer for batch JSONL writes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 
 def load_config(config_path: Path | None = None) -> dict:
     """Load LoRA config from YAML."""
@@ -43,44 +47,6 @@ def load_config(config_path: Path | None = None) -> dict:
         return yaml.safe_load(f)
 
 
-def load_model(config: dict, adapter_path: Path | None = None):
-    """Load base model with quantization and LoRA adapter."""
-    model_name = config["model"]["base"]
-
-    # Quantization config
-    qcfg = config["quantization"]
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=qcfg["load_in_4bit"],
-        bnb_4bit_quant_type=qcfg["bnb_4bit_quant_type"],
-        bnb_4bit_compute_dtype=getattr(torch, qcfg["bnb_4bit_compute_dtype"]),
-        bnb_4bit_use_double_quant=qcfg["bnb_4bit_use_double_quant"],
-    )
-
-    print(f"Loading base model: {model_name}")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        quantization_config=bnb_config,
-        device_map="auto",
-        torch_dtype=torch.bfloat16,
-    )
-
-    # Load LoRA adapter
-    if adapter_path is None:
-        adapter_path = ML_ROOT / config["output_dir"] / "final"
-    if adapter_path.exists():
-        print(f"Loading LoRA adapter: {adapter_path}")
-        model = PeftModel.from_pretrained(model, str(adapter_path))
-    else:
-        print(f"WARNING: No adapter found at {adapter_path}, using base model")
-
-    model.eval()
-    return model, tokenizer
-
-
 def build_prompt(intent: str) -> list[dict]:
     """Build chat messages for the intent → assembly task."""
     return [
@@ -89,6 +55,11 @@ def build_prompt(intent: str) -> list[dict]:
     ]
 
 
+def render_prompt(tokenizer, intent: str) -> str:
+    """Render the generation prompt for one intent without re-running the template."""
+    return render_messages(tokenizer, build_prompt(intent))
+
+
 def generate_assembly(
     model,
     tokenizer,
@@ -96,27 +67,55 @@ def generate_assembly(
     config: dict,
 ) -> str:
     """Generate assembly from a single intent."""
-    messages = build_prompt(intent)
-    input_text = tokenizer.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True
-    )
-    inputs = tokenizer(input_text, return_tensors="pt").to(model.device)
+    return generate_assembly_batch(model, tokenizer, [intent], config)[0]
+
+
+def generate_assembly_batch(
+    model,
+    tokenizer,
+    intents: list[str],
+    config: dict,
+) -> list[str]:
+    """Generate assembly for a batch of intents in one model.generate call.
+
+    Prompts are left-padded so every row's new tokens start at the same
+    offset. Returns one assembly per intent, in input order.
+    """
+    input_texts = [render_prompt(tokenizer, intent) for intent in intents]
+    inputs = to_device(tokenizer(input_texts, return_tensors="pt", padding=True), model.device)
 
     inf_cfg = config["inference"]
-    with torch.no_grad():
+    gen_kwargs = {
+        "max_new_tokens": inf_cfg["max_new_tokens"],
+        "do_sample": inf_cfg["do_sample"],
+        "use_cache": True,
+        "pad_token_id": tokenizer.pad_token_id,
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+    # Sampling parameters are only meaningful (and only accepted without
+    # warnings) when sampling is enabled
+    if inf_cfg["do_sample"]:
+        gen_kwargs["temperature"] = inf_cfg["temperature"]
+        gen_kwargs["top_p"] = inf_cfg["top_p"]
+    else:
+        # Clear sampling defaults inherited from the model's generation_config
+        # so greedy decoding builds no temperature/top-p warpers
+        gen_kwargs["temperature"] = None
+        gen_kwargs["top_p"] = None
+
+    with torch.inference_mode():
         outputs = model.generate(
-            **inputs,
-            max_new_tokens=inf_cfg["max_new_tokens"],
-            temperature=inf_cfg["temperature"] if inf_cfg["do_sample"] else 1.0,
-            top_p=inf_cfg["top_p"] if inf_cfg["do_sample"] else 1.0,
-            do_sample=inf_cfg["do_sample"],
-            pad_token_id=tokenizer.pad_token_id,
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            **gen_kwargs,
         )
 
-    # Extract only the generated tokens (after input)
-    generated = outputs[0][inputs["input_ids"].shape[1]:]
-    assembly = tokenizer.decode(generated, skip_special_tokens=True).strip()
-    return assembly
+    # Extract only the generated tokens (after the padded input)
+    generated = outputs[:, inputs["input_ids"].shape[1]:]
+    return [
+        text.strip()
+        for text in tokenizer.batch_decode(generated, skip_special_tokens=True)
+    ]
 
 
 def main():
@@ -127,6 +126,8 @@ def main():
     parser.add_argument("--input", type=Path, help="Input JSONL file with intents")
     parser.add_argument("--output", type=Path, help="Output JSONL file for generations")
     parser.add_argument("--interactive", action="store_true", help="Interactive mode")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Intents per generate call with --input (default: 16)")
     args = parser.parse_args()
 
     config = load_config(args.config)
@@ -142,24 +143,30 @@ def main():
             sys.exit(1)
         args.output.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(args.input) as fin, open(args.output, "w") as fout:
-            for line_num, line in enumerate(fin, 1):
-                entry = json.loads(line.strip())
-                intent = entry["intent"]
-                print(f"[{line_num}] {intent[:60]}...", end=" ", flush=True)
-                assembly = generate_assembly(model, tokenizer, intent, config)
-                result = {
-                    "intent": intent,
-                    "generated_assembly": assembly,
-                }
-                if "assembly" in entry:
-                    result["reference_assembly"] = entry["assembly"]
-                if "witnesses" in entry:
-                    result["witnesses"] = entry["witnesses"]
-                fout.write(json.dumps(result, ensure_ascii=False) + "\n")
-                print("done")
-
-        print(f"\nGenerated {line_num} assemblies → {args.output}")
+        entries = [fastjson.loads(line) for line in args.input.read_bytes().splitlines() if line.strip()]
+
+        with open(args.output, "wb", buffering=WRITE_BUFFER_SIZE) as fout, \
+                tqdm(total=len(entries), unit="intent") as progress:
+            for start in range(0, len(entries), args.batch_size):
+                batch = entries[start:start + args.batch_size]
+                assemblies = generate_assembly_batch(
+                    model, tokenizer, [entry["intent"] for entry in batch], config
+                )
+                lines = []
+                for entry, assembly in zip(batch, assemblies):
+                    result = {
+                        "intent": entry["intent"],
+                        "generated_assembly": assembly,
+                    }
+                    if "assembly" in entry:
+                        result["reference_assembly"] = entry["assembly"]
+                    if "witnesses" in entry:
+                        result["witnesses"] = entry["witnesses"]
+                    lines.append(fastjson.dumps(result) + b"\n")
+                fout.write(b"".join(lines))
+                progress.update(len(batch))
+
+        print(f"\nGenerated {len(entries)} assemblies → {args.output}")
 
     elif args.interactive:
         print("NoLang Assembly Generator (type 'quit' to exit)")
@@ -15,17 +15,15 @@ Usage:
 """
 
 import argparse
-import json
 import sys
 from pathlib import Path
 
 import torch
 import yaml
-from peft import PeftModel
-from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from tqdm import tqdm
 
-SCRIPT_DIR = Path(__file__).resolve().parent
-ML_ROOT = SCRIPT_DIR.parent
+import fastjson
+from inference_common import ML_ROOT, load_model, render_messages, to_device
 
 SYSTEM_PROMPT = (
     "You are a NoLang code explainer. Describe what this program does in plain "
@@ -33,6 +31,9 @@ SYSTEM_PROMPT = (
     "Do NOT explain syntax. Describe what the code DOES, not what it was INTENDED to do."
 )
 
+# Output buffer for batch JSONL writes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
 
 def load_config(config_path: Path | None = None) -> dict:
     """Load LoRA config from YAML."""
@@ -42,42 +43,6 @@ def load_config(config_path: Path | None = None) -> dict:
         return yaml.safe_load(f)
 
 
-def load_model(config: dict, adapter_path: Path | None = None):
-    """Load base model with quantization and LoRA adapter."""
-    model_name = config["model"]["base"]
-
-    qcfg = config["quantization"]
-    bnb_config = BitsAndBytesConfig(
-        load_in_4bit=qcfg["load_in_4bit"],
-        bnb_4bit_quant_type=qcfg["bnb_4bit_quant_type"],
-        bnb_4bit_compute_dtype=getattr(torch, qcfg["bnb_4bit_compute_dtype"]),
-        bnb_4bit_use_double_quant=qcfg["bnb_4bit_use_double_quant"],
-    )
-
-    print(f"Loading base model: {model_name}")
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        quantization_config=bnb_config,
-        device_map="auto",
-        torch_dtype=torch.bfloat16,
-    )
-
-    if adapter_path is None:
-        adapter_path = ML_ROOT / config["output_dir"] / "final"
-    if adapter_path.exists():
-        print(f"Loading LoRA adapter: {adapter_path}")
-        model = PeftModel.from_pretrained(model, str(adapter_path))
-    else:
-        print(f"WARNING: No adapter found at {adapter_path}, using base model")
-
-    model.eval()
-    return model, tokenizer
-
-
 def build_prompt(assembly: str) -> list[dict]:
     """Build chat messages for the assembly → description task."""
     return [
@@ -86,6 +51,11 @@ def build_prompt(assembly: str) -> list[dict]:
     ]
 
 
+def render_prompt(tokenizer, assembly: str) -> str:
+    """Render the generation prompt for one assembly without re-running the template."""
+    return render_messages(tokenizer, build_prompt(assembly))
+
+
 def generate_description(
     model,
     tokenizer,
@@ -93,26 +63,55 @@ def generate_description(
     config: dict,
 ) -> str:
     """Generate description from assembly."""
-    messages = build_prompt(assembly)
-    input_text = tokenizer.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=True
-    )
-    inputs = tokenizer(input_text, return_tensors="pt").to(model.device)
+    return generate_description_batch(model, tokenizer, [assembly], config)[0]
+
+
+def generate_description_batch(
+    model,
+    tokenizer,
+    assemblies: list[str],
+    config: dict,
+) -> list[str]:
+    """Generate descriptions for a batch of assemblies in one model.generate call.
+
+    Prompts are left-padded so every row's new tokens start at the same
+    offset. Returns one description per assembly, in input order.
+    """
+    input_texts = [render_prompt(tokenizer, assembly) for assembly in assemblies]
+    inputs = to_device(tokenizer(input_texts, return_tensors="pt", padding=True), model.device)
 
     inf_cfg = config["inference"]
-    with torch.no_grad():
+    gen_kwargs = {
+        "max_new_tokens": inf_cfg["max_new_tokens"],
+        "do_sample": inf_cfg["do_sample"],
+        "use_cache": True,
+        "pad_token_id": tokenizer.pad_token_id,
+        "eos_token_id": tokenizer.eos_token_id,
+    }
+    # Sampling parameters are only meaningful (and only accepted without
+    # warnings) when sampling is enabled
+    if inf_cfg["do_sample"]:
+        gen_kwargs["temperature"] = inf_cfg["temperature"]
+        gen_kwargs["top_p"] = inf_cfg["top_p"]
+    else:
+        # Clear sampling defaults inherited from the model's generation_config
+        # so greedy decoding builds no temperature/top-p warpers
+        gen_kwargs["temperature"] = None
+        gen_kwargs["top_p"] = None
+
+    with torch.inference_mode():
         outputs = model.generate(
-            **inputs,
-            max_new_tokens=inf_cfg["max_new_tokens"],
-            temperature=inf_cfg["temperature"] if inf_cfg["do_sample"] else 1.0,
-            top_p=inf_cfg["top_p"] if inf_cfg["do_sample"] else 1.0,
-            do_sample=inf_cfg["do_sample"],
-            pad_token_id=tokenizer.pad_token_id,
+            input_ids=inputs["input_ids"],
+            attention_mask=inputs["attention_mask"],
+            **gen_kwargs,
         )
 
-    generated = outputs[0][inputs["input_ids"].shape[1]:]
-    description = tokenizer.decode(generated, skip_special_tokens=True).strip()
-    return description
+    # Extract only the generated tokens (after the padded input)
+    generated = outputs[:, inputs["input_ids"].shape[1]:]
+    return [
+        text.strip()
+        for text in tokenizer.batch_decode(generated, skip_special_tokens=True)
+    ]
 
 
 def main():
@@ -123,6 +122,8 @@ def main():
     parser.add_argument("--file", type=Path, help="Assembly .nol file to describe")
     parser.add_argument("--input", type=Path, help="Input JSONL file with assemblies")
     parser.add_argument("--output", type=Path, help="Output JSONL file for descriptions")
+    parser.add_argument("--batch-size", type=int, default=16,
+                        help="Assemblies per generate call with --input (default: 16)")
     args = parser.parse_args()
 
     config = load_config(args.config)
@@ -146,22 +147,28 @@ def main():
             sys.exit(1)
         args.output.parent.mkdir(parents=True, exist_ok=True)
 
-        with open(args.input) as fin, open(args.output, "w") as fout:
-            for line_num, line in enumerate(fin, 1):
-                entry = json.loads(line.strip())
-                assembly = entry["assembly"]
-                print(f"[{line_num}] {assembly[:50].replace(chr(10), ' / ')}...", end=" ", flush=True)
-                desc = generate_description(model, tokenizer, assembly, config)
-                result = {
-                    "assembly": assembly,
-                    "generated_description": desc,
-                }
-                if "description" in entry:
-                    result["reference_description"] = entry["description"]
-                fout.write(json.dumps(result, ensure_ascii=False) + "\n")
-                print("done")
-
-        print(f"\nGenerated {line_num} descriptions → {args.output}")
+        entries = [fastjson.loads(line) for line in args.input.read_bytes().splitlines() if line.strip()]
+
+        with open(args.output, "wb", buffering=WRITE_BUFFER_SIZE) as fout, \
+                tqdm(total=len(entries), unit="program") as progress:
+            for start in range(0, len(entries), args.batch_size):
+                batch = entries[start:start + args.batch_size]
+                descs = generate_description_batch(
+                    model, tokenizer, [entry["assembly"] for entry in batch], config
+                )
+                lines = []
+                for entry, desc in zip(batch, descs):
+                    result = {
+                        "assembly": entry["assembly"],
+                        "generated_description": desc,
+                    }
+                    if "description" in entry:
+                        result["reference_description"] = entry["description"]
+                    lines.append(fastjson.dumps(result) + b"\n")
+                fout.write(b"".join(lines))
+                progress.update(len(batch))
+
+        print(f"\nGenerated {len(entries)} descriptions → {args.output}")
 
     else:
         parser.print_help()
@@ -0,0 +1,139 @@
+"""Model loading and prompt rendering shared by the 7a and 7b inference scripts."""
+
+from functools import lru_cache
+from pathlib import Path
+
+import torch
+from peft import PeftModel
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+ML_ROOT = SCRIPT_DIR.parent
+
+# Stand-in user message used to split the rendered chat template
+_PLACEHOLDER = "__NOLANG_USER_CONTENT__"
+
+
+def load_base_model(config: dict):
+    """Load the quantized base model and tokenizer, without an adapter."""
+    model_name = config["model"]["base"]
+
+    # Quantization config
+    qcfg = config["quantization"]
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=qcfg["load_in_4bit"],
+        bnb_4bit_quant_type=qcfg["bnb_4bit_quant_type"],
+        bnb_4bit_compute_dtype=getattr(torch, qcfg["bnb_4bit_compute_dtype"]),
+        bnb_4bit_use_double_quant=qcfg["bnb_4bit_use_double_quant"],
+    )
+
+    print(f"Loading base model: {model_name}")
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    # Batched generation needs left padding so new tokens line up on the right
+    tokenizer.padding_side = "left"
+
+    inf_cfg = config.get("inference", {})
+    attn_impl = inf_cfg.get("attn_implementation", "flash_attention_2")
+    try:
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            quantization_config=bnb_config,
+            device_map="auto",
+            torch_dtype=torch.bfloat16,
+            attn_implementation=attn_impl,
+        )
+    except (ImportError, ValueError) as e:
+        if attn_impl == "sdpa":
+            raise
+        print(f"WARNING: {attn_impl} unavailable ({e}), falling back to sdpa")
+        model = AutoModelForCausalLM.from_pretrained(
+            model_name,
+            quantization_config=bnb_config,
+            device_map="auto",
+            torch_dtype=torch.bfloat16,
+            attn_implementation="sdpa",
+        )
+
+    return model, tokenizer
+
+
+def attach_adapter(model, config: dict, adapter_path: Path | None = None):
+    """Attach the task's LoRA adapter to a base model and prepare it for inference."""
+    # Load LoRA adapter
+    if adapter_path is None:
+        adapter_path = ML_ROOT / config["output_dir"] / "final"
+    if adapter_path.exists():
+        print(f"Loading LoRA adapter: {adapter_path}")
+        model = PeftModel.from_pretrained(model, str(adapter_path))
+    else:
+        print(f"WARNING: No adapter found at {adapter_path}, using base model")
+
+    model.eval()
+    return model
+
+
+def load_model(config: dict, adapter_path: Path | None = None):
+    """Load base model with quantization and LoRA adapter."""
+    model, tokenizer = load_base_model(config)
+    return attach_adapter(model, config, adapter_path), tokenizer
+
+
+@lru_cache(maxsize=8)
+def _template_parts(tokenizer, system_prompt: str) -> tuple[str, str, bool] | None:
+    """Split the rendered chat template around the user message.
+
+    Returns (head, tail, trims): a prompt is head + content + tail, with the
+    content stripped first when the template trims messages. Returns None
+    if the template does not render the user content verbatim.
+    """
+    def render(content: str) -> str:
+        return tokenizer.apply_chat_template(
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": content},
+            ],
+            tokenize=False,
+            add_generation_prompt=True,
+        )
+
+    parts = render(_PLACEHOLDER).split(_PLACEHOLDER)
+    if len(parts) != 2:
+        return None
+    head, tail = parts
+    padded = render(f" {_PLACEHOLDER} ")
+    if padded == f"{head} {_PLACEHOLDER} {tail}":
+        return head, tail, False
+    if padded == f"{head}{_PLACEHOLDER}{tail}":
+        return head, tail, True
+    return None
+
+
+def render_messages(tokenizer, messages: list[dict]) -> str:
+    """Render [system, user] chat messages without re-running the template."""
+    system, user = messages
+    parts = _template_parts(tokenizer, system["content"])
+    if parts is None:
+        return tokenizer.apply_chat_template(
+            messages, tokenize=False, add_generation_prompt=True
+        )
+    head, tail, trims = parts
+    content = user["content"]
+    return head + (content.strip() if trims else content) + tail
+
+
+def to_device(inputs, device):
+    """Move tokenized inputs to device, via pinned memory when it is a GPU.
+
+    Pinned host buffers let the copy run asynchronously instead of staging
+    through pageable memory on every batch.
+    """
+    device = torch.device(device)
+    if device.type != "cuda":
+        return inputs.to(device)
+    return {
+        key: tensor.pin_memory().to(device, non_blocking=True)
+        for key, tensor in inputs.items()
+    }
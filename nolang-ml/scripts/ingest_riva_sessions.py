@@ -13,6 +13,7 @@ import argparse
 import base64
 import json
 import logging
+import os
 import subprocess
 import sys
 import tempfile
@@ -24,6 +25,12 @@ SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
 PROJECT_ROOT = ML_ROOT.parent
 
+# Scratch directory for assembler input/output — RAM-backed /dev/shm when
+# available, overridable with NOLANG_TMP (same as validate.py)
+TMP_DIR = os.environ.get("NOLANG_TMP") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else None
+)
+
 
 def find_nol_pairs(session_data: dict) -> list[tuple[str, str]]:
     """Extract (intent, assembly) pairs from a RIVA session.
@@ -57,32 +64,27 @@ def validate_assembly(assembly: str, nol_binary: Path) -> tuple[bool, bytes | No
 
     Returns (is_valid, binary_bytes_or_none).
     """
-    with tempfile.NamedTemporaryFile(suffix=".nol", mode="w", delete=False) as f:
-        f.write(assembly)
-        input_path = Path(f.name)
-
-    output_path = input_path.with_suffix(".nolb")
-
-    try:
-        result = subprocess.run(
-            [str(nol_binary), "assemble", str(input_path), "-o", str(output_path)],
-            capture_output=True,
-            text=True,
-            timeout=10,
-        )
-
-        if result.returncode == 0 and output_path.exists():
-            binary = output_path.read_bytes()
-            return True, binary
-        else:
-            logger.warning("Assembly failed: %s", result.stderr.strip())
+    with tempfile.TemporaryDirectory(dir=TMP_DIR) as tmp:
+        input_path = Path(tmp) / "program.nol"
+        output_path = input_path.with_suffix(".nolb")
+        input_path.write_text(assembly)
+
+        try:
+            result = subprocess.run(
+                [str(nol_binary), "assemble", str(input_path), "-o", str(output_path)],
+                capture_output=True,
+                text=True,
+                timeout=10,
+            )
+        except subprocess.TimeoutExpired:
+            logger.warning("Assembly timed out")
             return False, None
-    except subprocess.TimeoutExpired:
-        logger.warning("Assembly timed out")
+
+        # nolang assemble only exits 0 after writing the output file
+        if result.returncode == 0:
+            return True, output_path.read_bytes()
+        logger.warning("Assembly failed: %s", result.stderr.strip())
         return False, None
-    finally:
-        input_path.unlink(missing_ok=True)
-        output_path.unlink(missing_ok=True)
 
 
 def ingest_sessions(
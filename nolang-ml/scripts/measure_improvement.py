@@ -29,46 +29,56 @@ Usage:
 """
 
 import argparse
-import json
+import os
 import sys
 import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
 
+# Sibling scripts are importable when measure_improvement is imported too
+if str(SCRIPT_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPT_DIR))
+
+import fastjson
+from evaluate import evaluate_7a
+from validate import validate_assembly
+
+# 7a metrics compared between baseline and improved, as (key, label)
+DELTA_METRICS = (
+    ("assembled_pct", "Syntax validity"),
+    ("verified_pct", "Verification pass"),
+    ("witness_pass_pct", "Witness pass"),
+)
+
 
 def load_metrics(path: Path) -> dict:
     """Load metrics JSON file."""
     if not path.exists():
         print(f"ERROR: Metrics file not found: {path}", file=sys.stderr)
         sys.exit(1)
-    with open(path) as f:
-        return json.load(f)
+    return fastjson.loads(path.read_bytes())
 
 
-def evaluate_generations(gen_path: Path) -> dict:
+def evaluate_generations(gen_path: Path, workers: int | None = None) -> dict:
     """Run evaluation on a generations file and return metrics."""
-    sys.path.insert(0, str(SCRIPT_DIR))
-    from evaluate import evaluate_7a
-    return evaluate_7a(gen_path)
+    return evaluate_7a(gen_path, workers=workers)
 
 
 def compute_deltas(baseline: dict, improved: dict) -> dict:
     """Compute metric deltas between baseline and improved."""
-    metrics = ["assembled_pct", "verified_pct", "witness_pass_pct"]
-    labels = ["Syntax validity", "Verification pass", "Witness pass"]
-
     deltas = {}
-    for metric, label in zip(metrics, labels):
+    for metric, label in DELTA_METRICS:
         base_val = baseline.get(metric, 0.0)
         imp_val = improved.get(metric, 0.0)
-        delta = imp_val - base_val
         deltas[metric] = {
             "label": label,
             "baseline": base_val,
             "improved": imp_val,
-            "delta": delta,
+            "delta": imp_val - base_val,
         }
 
     return deltas
@@ -87,9 +97,7 @@ def check_gates(deltas: dict) -> tuple[bool, list[str]]:
     improved_count = 0
     regression_fail = False
 
-    metrics_order = ["assembled_pct", "verified_pct", "witness_pass_pct"]
-
-    for metric in metrics_order:
+    for metric, _ in DELTA_METRICS:
         info = deltas.get(metric)
         if info is None:
             continue
@@ -130,60 +138,70 @@ def find_regressions(
     if not baseline_gen_path.exists() or not improved_gen_path.exists():
         return []
 
-    sys.path.insert(0, str(SCRIPT_DIR))
-    from validate import validate_assembly
+    # Unchanged outputs across cycles validate once; witnesses are keyed by
+    # their JSON encoding since lists of dicts are not hashable
+    @lru_cache(maxsize=50_000)
+    def cached_validate(assembly: str, witnesses_json: bytes | None):
+        witnesses = fastjson.loads(witnesses_json) if witnesses_json else None
+        return validate_assembly(assembly, witnesses)
+
+    def validate_entry(entry: dict):
+        witnesses = entry.get("witnesses")
+        return cached_validate(
+            entry["generated_assembly"],
+            fastjson.dumps(witnesses) if witnesses else None,
+        )
 
-    # Load both generation files
+    # Index the baseline by intent (last entry wins)
     baseline_entries = {}
-    with open(baseline_gen_path) as f:
+    with open(baseline_gen_path, "rb") as f:
         for line in f:
-            entry = json.loads(line.strip())
+            entry = fastjson.loads(line)
             baseline_entries[entry["intent"]] = entry
-
-    improved_entries = {}
-    with open(improved_gen_path) as f:
-        for line in f:
-            entry = json.loads(line.strip())
-            improved_entries[entry["intent"]] = entry
-
-    regressions = []
-    for intent, base_entry in baseline_entries.items():
-        imp_entry = improved_entries.get(intent)
-        if imp_entry is None:
+    # Regressions are reported in baseline file order
+    baseline_order = list(baseline_entries)
+
+    # Parse improved entries one at a time, newest first so the last entry
+    # per intent wins; popping each match frees baseline entries as we go
+    regressed = {}
+    for line in reversed(improved_gen_path.read_bytes().splitlines()):
+        imp_entry = fastjson.loads(line)
+        base_entry = baseline_entries.pop(imp_entry["intent"], None)
+        if base_entry is None:
             continue
 
-        # Validate both
-        base_result = validate_assembly(
-            base_entry["generated_assembly"],
-            base_entry.get("witnesses"),
-        )
-        imp_result = validate_assembly(
-            imp_entry["generated_assembly"],
-            imp_entry.get("witnesses"),
-        )
+        # Only a passing baseline can regress, so validate it first
+        base_result = validate_entry(base_entry)
+        if not base_result.fully_valid:
+            continue
+        imp_result = validate_entry(imp_entry)
 
-        # Check for regression: base passed, improved failed
-        if base_result.fully_valid and not imp_result.fully_valid:
-            regressions.append({
-                "intent": intent,
+        if not imp_result.fully_valid:
+            regressed[imp_entry["intent"]] = {
+                "intent": imp_entry["intent"],
                 "baseline_status": "valid",
                 "improved_status": "invalid",
                 "improved_errors": imp_result.errors,
-            })
+            }
 
-    return regressions
+    return [regressed[intent] for intent in baseline_order if intent in regressed]
 
 
 def print_report(deltas: dict, gates_passed: bool, gate_messages: list[str],
                  regressions: list[dict], cycle: int):
-    """Print formatted improvement report."""
-    print("\n" + "=" * 70)
-    print(f"IMPROVEMENT REPORT (Cycle {cycle})")
-    print("=" * 70)
+    """Print formatted improvement report.
+
+    Lines are collected and written to stdout in one call.
+    """
+    lines = [
+        "\n" + "=" * 70,
+        f"IMPROVEMENT REPORT (Cycle {cycle})",
+        "=" * 70,
+    ]
 
     # Side-by-side table
-    print(f"\n{'Metric':<22} {'Phase 7':>10} {'Phase 8':>10} {'Delta':>10}")
-    print("-" * 54)
+    lines.append(f"\n{'Metric':<22} {'Phase 7':>10} {'Phase 8':>10} {'Delta':>10}")
+    lines.append("-" * 54)
 
     for info in deltas.values():
         label = info["label"]
@@ -191,27 +209,27 @@ def print_report(deltas: dict, gates_passed: bool, gate_messages: list[str],
         improved = info["improved"]
         delta = info["delta"]
         sign = "+" if delta >= 0 else ""
-        print(f"  {label:<20} {baseline:>8.1f}%  {improved:>8.1f}%  {sign}{delta:>7.1f}%")
+        lines.append(f"  {label:<20} {baseline:>8.1f}%  {improved:>8.1f}%  {sign}{delta:>7.1f}%")
 
     # Gates
-    print(f"\n{'Gates':}")
-    print("-" * 54)
-    for msg in gate_messages:
-        print(f"  {msg}")
-    print(f"\n  Overall: {'PASS' if gates_passed else 'FAIL'}")
+    lines.append(f"\n{'Gates':}")
+    lines.append("-" * 54)
+    lines.extend(f"  {msg}" for msg in gate_messages)
+    lines.append(f"\n  Overall: {'PASS' if gates_passed else 'FAIL'}")
 
     # Regressions
     if regressions:
-        print(f"\nRegressions ({len(regressions)} examples):")
-        print("-" * 54)
+        lines.append(f"\nRegressions ({len(regressions)} examples):")
+        lines.append("-" * 54)
         for reg in regressions[:10]:  # Show first 10
-            print(f"  {reg['intent'][:60]}")
+            lines.append(f"  {reg['intent'][:60]}")
             if reg.get("improved_errors"):
-                print(f"    Errors: {'; '.join(reg['improved_errors'][:2])}")
+                lines.append(f"    Errors: {'; '.join(reg['improved_errors'][:2])}")
         if len(regressions) > 10:
-            print(f"  ... and {len(regressions) - 10} more")
+            lines.append(f"  ... and {len(regressions) - 10} more")
 
-    print("\n" + "=" * 70)
+    lines.append("\n" + "=" * 70)
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 def main():
@@ -245,15 +263,16 @@ def main():
     )
     args = parser.parse_args()
 
-    # Determine metrics sources
+    # Determine metrics sources; generation files are evaluated below
     baseline_metrics = None
     improved_metrics = None
+    baseline_gen = None
+    improved_gen = None
 
     if args.baseline and args.baseline.exists():
         baseline_metrics = load_metrics(args.baseline)
     elif args.baseline_generations and args.baseline_generations.exists():
-        print("Evaluating baseline generations...")
-        baseline_metrics = evaluate_generations(args.baseline_generations)
+        baseline_gen = args.baseline_generations
     else:
         # Try default locations
         default_baseline = ML_ROOT / "outputs" / "metrics" / "metrics_7a.json"
@@ -267,8 +286,7 @@ def main():
     if args.improved and args.improved.exists():
         improved_metrics = load_metrics(args.improved)
     elif args.improved_generations and args.improved_generations.exists():
-        print("Evaluating improved generations...")
-        improved_metrics = evaluate_generations(args.improved_generations)
+        improved_gen = args.improved_generations
     else:
         default_improved = ML_ROOT / "outputs" / "metrics" / f"metrics_8a_v{args.cycle}.json"
         if default_improved.exists():
@@ -278,6 +296,23 @@ def main():
                   file=sys.stderr)
             sys.exit(1)
 
+    if baseline_gen and improved_gen:
+        # Overlap both evaluations, splitting the CPUs between their
+        # validator pools
+        print("Evaluating baseline and improved generations in parallel...")
+        workers = max(1, (os.cpu_count() or 1) // 2)
+        with ProcessPoolExecutor(max_workers=2) as executor:
+            baseline_future = executor.submit(evaluate_generations, baseline_gen, workers)
+            improved_future = executor.submit(evaluate_generations, improved_gen, workers)
+            baseline_metrics = baseline_future.result()
+            improved_metrics = improved_future.result()
+    elif baseline_gen:
+        print("Evaluating baseline generations...")
+        baseline_metrics = evaluate_generations(baseline_gen)
+    elif improved_gen:
+        print("Evaluating improved generations...")
+        improved_metrics = evaluate_generations(improved_gen)
+
     # Compute deltas
     deltas = compute_deltas(baseline_metrics, improved_metrics)
 
@@ -303,14 +338,13 @@ def main():
         "cycle": args.cycle,
         "baseline": baseline_metrics,
         "improved": improved_metrics,
-        "deltas": {k: v for k, v in deltas.items()},
+        "deltas": deltas,
         "gates_passed": gates_passed,
         "gate_messages": gate_messages,
         "regressions_count": len(regressions),
         "regressions": regressions[:20],  # Cap at 20 for file size
     }
-    with open(output_path, "w") as f:
-        json.dump(report, f, indent=2)
+    output_path.write_bytes(fastjson.dumps(report, indent=True))
 
     print(f"\nReport saved to: {output_path}")
 
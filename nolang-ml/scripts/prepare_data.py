@@ -9,12 +9,26 @@ creates stratified 80/10/10 train/val/test splits for:
 Outputs JSON-lines files to data/splits/.
 """
 
-import json
+import multiprocessing
 import os
 import re
 import sys
-from collections import defaultdict
+from array import array
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import repeat
 from pathlib import Path
+from types import EllipsisType
+
+import fastjson
+
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = SCRIPT_DIR.parent.parent  # nolang-ml/../ = nol/
@@ -26,6 +40,18 @@ CORPUS_FILES = [
 ]
 OUTPUT_DIR = ML_ROOT / "data" / "splits"
 
+# Corpus files shorter than this are parsed in-process; below it, worker
+# startup costs more than the parse itself
+PARALLEL_MIN_LINES = 50_000
+
+# Serialized bytes accumulated per write in write_jsonl
+WRITE_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Corpus.witnesses value for an entry without a "witnesses" key, so that
+# "witnesses": null is still written out. Ellipsis stays the same object
+# when pickled to and from the parse workers.
+NO_WITNESSES = ...
+
 # Category inference from intent text (heuristic, for stratification)
 CATEGORY_PATTERNS = [
     ("arithmetic", re.compile(r"add|subtract|multiply|divide|negate|absolute|sum|square|cube|factorial|fibonacci|modulo|remainder|power|increment|decrement", re.I)),
@@ -42,44 +68,157 @@ CATEGORY_PATTERNS = [
     ("forall", re.compile(r"forall|for all|every|each element|all elements", re.I)),
     ("identity", re.compile(r"identity|return.*constant|return.*value|halt", re.I)),
 ]
+# Whitespace-delimited all-uppercase words (opcodes) in assembly text
+_OPCODE_RE = re.compile(r"(?<!\S)[A-Z]+(?!\S)")
+
+
+def _compile_category_db():
+    """Compile CATEGORY_PATTERNS into one Hyperscan database, if available."""
+    if hyperscan is None:
+        return None
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[pattern.pattern.encode() for _, pattern in CATEGORY_PATTERNS],
+        ids=list(range(len(CATEGORY_PATTERNS))),
+        elements=len(CATEGORY_PATTERNS),
+        flags=[hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH
+               | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_UCP] * len(CATEGORY_PATTERNS),
+    )
+    return db
 
 
+_CATEGORY_DB = _compile_category_db()
+
+
+@lru_cache(maxsize=None)
 def infer_category(intent: str) -> str:
-    """Infer a category from intent text for stratification purposes."""
+    """Infer a category from intent text for stratification purposes.
+
+    With hyperscan installed, all patterns are tested in a single scan and
+    the lowest matching pattern id wins, same as the first-match loop.
+    """
+    if _CATEGORY_DB is not None:
+        matched = []
+        _CATEGORY_DB.scan(
+            intent.encode("utf-8"),
+            match_event_handler=lambda pattern_id, *_: matched.append(pattern_id),
+        )
+        return CATEGORY_PATTERNS[min(matched)][0] if matched else "other"
+
     for name, pattern in CATEGORY_PATTERNS:
         if pattern.search(intent):
             return name
     return "other"
 
 
-def load_corpus() -> list[dict]:
-    """Load all .nolt entries from corpus files."""
-    entries = []
-    for path in CORPUS_FILES:
-        if not path.exists():
-            print(f"WARNING: Corpus file not found: {path}", file=sys.stderr)
+def _read_corpus_file(path: Path) -> bytes | None:
+    """Read a whole corpus file, or return None if it does not exist."""
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+@dataclass(slots=True)
+class Corpus:
+    """Corpus entries stored column-wise, one sequence per field.
+
+    Entry i is (intents[i], assemblies[i], witnesses[i]); sources index
+    CORPUS_FILES. Categories are inferred per unique intent when splitting.
+    """
+
+    intents: list[str] = field(default_factory=list)
+    assemblies: list[str] = field(default_factory=list)
+    witnesses: list[list | None | EllipsisType] = field(default_factory=list)
+    sources: array = field(default_factory=lambda: array("b"))
+
+    def __len__(self) -> int:
+        return len(self.intents)
+
+    def extend(self, other: "Corpus") -> None:
+        """Append all entries of other."""
+        self.intents.extend(other.intents)
+        self.assemblies.extend(other.assemblies)
+        self.witnesses.extend(other.witnesses)
+        self.sources.extend(other.sources)
+
+
+def _parse_lines(
+    lines: list[bytes],
+    path: str,
+    first_line: int,
+    source: int,
+) -> tuple[Corpus, list[str]]:
+    """Parse a run of corpus lines.
+
+    Returns the parsed entries and any warnings, numbered from first_line,
+    so callers can merge chunks from worker processes in order.
+    """
+    corpus = Corpus()
+    warnings = []
+    for line_num, line in enumerate(lines, first_line):
+        if not line.strip():
+            continue
+        try:
+            entry = fastjson.loads(line)
+        except fastjson.JSONDecodeError as e:
+            warnings.append(f"WARNING: {path}:{line_num}: {e}")
+            continue
+        if "intent" not in entry or "assembly" not in entry:
+            warnings.append(f"WARNING: {path}:{line_num}: missing intent/assembly")
             continue
-        with open(path) as f:
-            for line_num, line in enumerate(f, 1):
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    entry = json.loads(line)
-                except json.JSONDecodeError as e:
-                    print(f"WARNING: {path}:{line_num}: {e}", file=sys.stderr)
-                    continue
-                if "intent" not in entry or "assembly" not in entry:
-                    print(f"WARNING: {path}:{line_num}: missing intent/assembly", file=sys.stderr)
-                    continue
-                entry["_source"] = path.name
-                entry["_category"] = infer_category(entry["intent"])
-                entries.append(entry)
-    return entries
-
-
-def stratified_split(entries: list[dict], train_ratio=0.8, val_ratio=0.1):
-    """Split entries into train/val/test preserving category distribution.
+        corpus.intents.append(entry["intent"])
+        corpus.assemblies.append(entry["assembly"])
+        corpus.witnesses.append(entry.get("witnesses", NO_WITNESSES))
+        corpus.sources.append(source)
+    return corpus, warnings
+
+
+def load_corpus() -> Corpus:
+    """Load all .nolt entries from corpus files.
+
+    Files are read on a thread pool, so later files load from disk while
+    earlier ones are being parsed. Files of at least PARALLEL_MIN_LINES
+    lines are split into one chunk per CPU and parsed in worker processes;
+    chunks are merged in order, so the result matches a sequential scan.
+    The workers come from a forkserver, because forking while the I/O
+    threads run could copy a lock one of them holds into the child.
+    """
+    corpus = Corpus()
+    with ThreadPoolExecutor(max_workers=len(CORPUS_FILES)) as io, ExitStack() as stack:
+        pool = None
+        files = zip(CORPUS_FILES, io.map(_read_corpus_file, CORPUS_FILES))
+        for source, (path, data) in enumerate(files):
+            if data is None:
+                print(f"WARNING: Corpus file not found: {path}", file=sys.stderr)
+                continue
+            lines = data.splitlines()
+            if len(lines) >= PARALLEL_MIN_LINES:
+                if pool is None:
+                    pool = stack.enter_context(ProcessPoolExecutor(
+                        mp_context=multiprocessing.get_context("forkserver")
+                    ))
+                size = -(-len(lines) // (os.cpu_count() or 1))
+                starts = range(0, len(lines), size)
+                results = pool.map(
+                    _parse_lines,
+                    [lines[start:start + size] for start in starts],
+                    repeat(str(path)),
+                    [start + 1 for start in starts],
+                    repeat(source),
+                )
+            else:
+                results = [_parse_lines(lines, str(path), 1, source)]
+
+            for part, warnings in results:
+                for warning in warnings:
+                    print(warning, file=sys.stderr)
+                corpus.extend(part)
+    return corpus
+
+
+def stratified_split(corpus: Corpus, train_ratio=0.8, val_ratio=0.1):
+    """Split entry indices into train/val/test preserving category distribution.
 
     Groups by intent to prevent data leakage: all entries sharing the same
     intent string go into the same split.
@@ -87,16 +226,15 @@ def stratified_split(entries: list[dict], train_ratio=0.8, val_ratio=0.1):
     import random
     random.seed(42)
 
-    # Group entries by intent to prevent leakage
-    intent_groups: dict[str, list[dict]] = defaultdict(list)
-    for entry in entries:
-        intent_groups[entry["intent"]].append(entry)
+    # Group entry indices by intent to prevent leakage
+    intent_groups: dict[str, list[int]] = defaultdict(list)
+    for i, intent in enumerate(corpus.intents):
+        intent_groups[intent].append(i)
 
-    # Categorize each unique intent
+    # Categorize each unique intent once
     by_category: dict[str, list[str]] = defaultdict(list)
-    for intent, group in intent_groups.items():
-        cat = group[0]["_category"]
-        by_category[cat].append(intent)
+    for intent in intent_groups:
+        by_category[infer_category(intent)].append(intent)
 
     train, val, test = [], [], []
 
@@ -129,68 +267,76 @@ def stratified_split(entries: list[dict], train_ratio=0.8, val_ratio=0.1):
     return train, val, test
 
 
-def format_7a(entry: dict) -> dict:
-    """Format entry for intent → assembly task."""
-    result = {"intent": entry["intent"], "assembly": entry["assembly"]}
-    if "witnesses" in entry:
-        result["witnesses"] = entry["witnesses"]
+def format_7a(corpus: Corpus, i: int) -> dict:
+    """Format entry i for intent → assembly task."""
+    result = {"intent": corpus.intents[i], "assembly": corpus.assemblies[i]}
+    if corpus.witnesses[i] is not NO_WITNESSES:
+        result["witnesses"] = corpus.witnesses[i]
     return result
 
 
-def format_7b(entry: dict) -> dict:
-    """Format entry for assembly → description task."""
-    return {"assembly": entry["assembly"], "description": entry["intent"]}
+def format_7b(corpus: Corpus, i: int) -> dict:
+    """Format entry i for assembly → description task."""
+    return {"assembly": corpus.assemblies[i], "description": corpus.intents[i]}
 
 
 def write_jsonl(entries: list[dict], path: Path):
-    """Write entries as JSON-lines."""
+    """Write entries as JSON-lines.
+
+    Lines accumulate in one buffer that is written out every
+    WRITE_CHUNK_SIZE bytes, so large splits need few writes and bounded memory.
+    """
     path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w") as f:
+    buf = bytearray()
+    with open(path, "wb") as f:
         for entry in entries:
-            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            buf += fastjson.dumps(entry)
+            buf += b"\n"
+            if len(buf) >= WRITE_CHUNK_SIZE:
+                f.write(buf)
+                buf.clear()
+        f.write(buf)
 
 
 def main():
     print("Loading corpus...")
-    entries = load_corpus()
-    print(f"  Loaded {len(entries)} entries from {len(CORPUS_FILES)} files")
+    corpus = load_corpus()
+    print(f"  Loaded {len(corpus)} entries from {len(CORPUS_FILES)} files")
 
-    # Report category distribution
-    cats = defaultdict(int)
-    for e in entries:
-        cats[e["_category"]] += 1
+    # Report category distribution, categorizing each unique intent once
+    cats: Counter[str] = Counter()
+    for intent, count in Counter(corpus.intents).items():
+        cats[infer_category(intent)] += count
     print("\n  Category distribution:")
     for cat, count in sorted(cats.items(), key=lambda x: -x[1]):
         print(f"    {cat:15s}: {count:4d}")
 
     print("\nSplitting 80/10/10...")
-    train, val, test = stratified_split(entries)
+    train, val, test = stratified_split(corpus)
     print(f"  Train: {len(train)}, Val: {len(val)}, Test: {len(test)}")
 
     # Write 7a splits
     print("\nWriting 7a splits (intent → assembly)...")
-    write_jsonl([format_7a(e) for e in train], OUTPUT_DIR / "train_7a.jsonl")
-    write_jsonl([format_7a(e) for e in val], OUTPUT_DIR / "val_7a.jsonl")
-    write_jsonl([format_7a(e) for e in test], OUTPUT_DIR / "test_7a.jsonl")
+    write_jsonl([format_7a(corpus, i) for i in train], OUTPUT_DIR / "train_7a.jsonl")
+    write_jsonl([format_7a(corpus, i) for i in val], OUTPUT_DIR / "val_7a.jsonl")
+    write_jsonl([format_7a(corpus, i) for i in test], OUTPUT_DIR / "test_7a.jsonl")
 
     # Write 7b splits
     print("Writing 7b splits (assembly → description)...")
-    write_jsonl([format_7b(e) for e in train], OUTPUT_DIR / "train_7b.jsonl")
-    write_jsonl([format_7b(e) for e in val], OUTPUT_DIR / "val_7b.jsonl")
-    write_jsonl([format_7b(e) for e in test], OUTPUT_DIR / "test_7b.jsonl")
+    write_jsonl([format_7b(corpus, i) for i in train], OUTPUT_DIR / "train_7b.jsonl")
+    write_jsonl([format_7b(corpus, i) for i in val], OUTPUT_DIR / "val_7b.jsonl")
+    write_jsonl([format_7b(corpus, i) for i in test], OUTPUT_DIR / "test_7b.jsonl")
 
     # Validate: check opcode coverage in test set
     all_opcodes = set()
-    for e in test:
-        for word in e["assembly"].split():
-            if word.isupper() and word.isalpha():
-                all_opcodes.add(word)
+    for i in test:
+        all_opcodes.update(_OPCODE_RE.findall(corpus.assemblies[i]))
     print(f"\n  Unique opcodes in test set: {len(all_opcodes)}")
     print(f"  Opcodes: {', '.join(sorted(all_opcodes))}")
 
     # Check for data leakage (same intent in train and test)
-    train_intents = {e["intent"] for e in train}
-    test_intents = {e["intent"] for e in test}
+    train_intents = {corpus.intents[i] for i in train}
+    test_intents = {corpus.intents[i] for i in test}
     leaked = train_intents & test_intents
     if leaked:
         print(f"\n  WARNING: {len(leaked)} intents appear in both train and test!")
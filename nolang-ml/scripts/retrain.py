@@ -21,10 +21,11 @@ Usage:
 """
 
 import argparse
-import json
+import hashlib
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable
 
 SCRIPT_DIR = Path(__file__).resolve().parent
 ML_ROOT = SCRIPT_DIR.parent
@@ -32,6 +33,10 @@ ML_ROOT = SCRIPT_DIR.parent
 # Add scripts dir to path for imports
 sys.path.insert(0, str(SCRIPT_DIR))
 
+import fastjson
+import train_7a
+import train_7b
+
 
 def load_config(config_path: Path) -> dict[str, Any]:
     """Load YAML configuration file."""
@@ -44,166 +49,188 @@ def load_jsonl(path: Path) -> list[dict]:
     """Load JSON-lines file."""
     if not path.exists():
         return []
+    # One read for the whole file, then parse line by line
     entries = []
-    with open(path) as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                try:
-                    entries.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
+    for line in path.read_bytes().splitlines():
+        if not line.strip():
+            continue
+        try:
+            entries.append(fastjson.loads(line))
+        except fastjson.JSONDecodeError:
+            continue
     return entries
 
 
-def format_7a_feedback_prompt(entry: dict, tokenizer) -> str:
-    """Format a feedback entry for 7a using error-aware system prompt.
-
-    Uses the standard train_7a system prompt plus the error context
-    from the feedback entry's system_suffix field.
-    """
-    from train_7a import SYSTEM_PROMPT
-
-    system_content = SYSTEM_PROMPT
-    suffix = entry.get("system_suffix", "")
-    if suffix:
-        system_content = system_content + suffix
-
-    messages = [
-        {"role": "system", "content": system_content},
-        {"role": "user", "content": f"Intent: {entry['intent']}"},
-        {"role": "assistant", "content": entry["assembly"]},
-    ]
-    return tokenizer.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=False
-    )
-
-
-def format_7b_feedback_prompt(entry: dict, tokenizer) -> str:
-    """Format a feedback entry for 7b using error-aware system prompt."""
-    from train_7b import SYSTEM_PROMPT
-
-    system_content = SYSTEM_PROMPT
-    suffix = entry.get("system_suffix", "")
-    if suffix:
-        system_content = system_content + suffix
-
-    messages = [
-        {"role": "system", "content": system_content},
-        {"role": "user", "content": f"Assembly:\n{entry['assembly']}"},
-        {"role": "assistant", "content": entry["description"]},
-    ]
-    return tokenizer.apply_chat_template(
-        messages, tokenize=False, add_generation_prompt=False
-    )
-
-
 def prepare_augmented_data(
     task: str,
     feedback_weight: int,
     tokenizer,
     max_length: int,
+    use_cache: bool = True,
 ) -> tuple:
     """Load original + feedback data, return augmented HuggingFace datasets.
 
+    Identical training conversations are stored once, with n_original and
+    n_feedback columns counting their occurrences; retrain() turns these
+    into sampler weights, upsampling feedback rather than copying it.
+    Tokenized datasets are cached like train_7a's, keyed additionally by the
+    feedback file contents, so re-runs with identical feedback skip
+    tokenization.
+
     Returns (train_dataset, val_dataset, stats_dict).
     """
-    from datasets import Dataset
-
     splits_dir = ML_ROOT / "data" / "splits"
     train_path = splits_dir / f"train_{task}.jsonl"
     val_path = splits_dir / f"val_{task}.jsonl"
     feedback_path = splits_dir / f"feedback_{task}.jsonl"
 
-    # Load original training data
-    original_train = load_jsonl(train_path)
-    val_data = load_jsonl(val_path)
-    feedback_data = load_jsonl(feedback_path)
+    fingerprint = train_7a.dataset_fingerprint(
+        [train_path, val_path, feedback_path], tokenizer, max_length,
+        train_7a.SYSTEM_PROMPT if task == "7a" else train_7b.SYSTEM_PROMPT,
+    )
+    cache_dir = train_7a.CACHE_DIR / f"retrain{task}_{fingerprint}"
+    if use_cache:
+        cached = train_7a.load_cached_datasets(cache_dir)
+        if cached is not None:
+            train_dataset, val_dataset, counts = cached
+            stats = _augmented_stats(counts, feedback_weight)
+            print(f"  Augmented training: {stats['augmented_train']} examples per epoch "
+                  f"({stats['original_train']} original + "
+                  f"{stats['feedback']} feedback x {feedback_weight}, "
+                  f"{stats['unique_train']} unique)")
+            print(f"  Validation:         {stats['val']} examples")
+            return train_dataset, val_dataset, stats
+
+    # Load original, validation and feedback data; the reads are
+    # independent, so overlap them
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        original_train, val_data, feedback_data = executor.map(
+            load_jsonl, [train_path, val_path, feedback_path]
+        )
 
     print(f"  Original training: {len(original_train)} examples")
     print(f"  Validation:        {len(val_data)} examples")
     print(f"  Feedback:          {len(feedback_data)} examples")
     print(f"  Feedback weight:   {feedback_weight}x")
 
-    # Format original data
+    # Build chat messages for every split (lazily). Feedback entries use the
+    # error-aware system prompt: the task's standard prompt plus the error
+    # context in their system_suffix field.
     if task == "7a":
-        from train_7a import format_chat_prompt
-        original_texts = [format_chat_prompt(e, tokenizer) for e in original_train]
-        feedback_texts = [format_7a_feedback_prompt(e, tokenizer) for e in feedback_data]
-        val_texts = [format_chat_prompt(e, tokenizer) for e in val_data]
+        fields = {
+            "system_prompt": train_7a.SYSTEM_PROMPT,
+            "user_template": train_7a.USER_TEMPLATE,
+            "assistant_key": "assembly",
+        }
     else:
-        from train_7b import format_chat_prompt
-        original_texts = [format_chat_prompt(e, tokenizer) for e in original_train]
-        feedback_texts = [format_7b_feedback_prompt(e, tokenizer) for e in feedback_data]
-        val_texts = [format_chat_prompt(e, tokenizer) for e in val_data]
-
-    # Upsample feedback examples
-    augmented_texts = original_texts + feedback_texts * feedback_weight
-    total_train = len(augmented_texts)
-
-    print(f"  Augmented training: {total_train} examples "
-          f"({len(original_texts)} original + {len(feedback_texts) * feedback_weight} feedback)")
-
-    # Tokenize
-    def tokenize_batch(texts: list[str]) -> Dataset:
-        dataset = Dataset.from_dict({"text": texts})
-        return dataset.map(
-            lambda x: _tokenize(x, tokenizer, max_length),
-            batched=True,
-            remove_columns=["text"],
-            desc="Tokenizing",
-        )
-
-    train_dataset = tokenize_batch(augmented_texts)
-    val_dataset = tokenize_batch(val_texts)
+        fields = {
+            "system_prompt": train_7b.SYSTEM_PROMPT,
+            "user_template": train_7b.USER_TEMPLATE,
+            "assistant_key": "description",
+        }
+    original_messages = train_7a.build_all_messages(original_train, **fields)
+    feedback_messages = train_7a.build_all_messages(
+        feedback_data, suffix_key="system_suffix", **fields
+    )
+    val_messages = train_7a.build_all_messages(val_data, **fields)
 
-    stats = {
+    # Each distinct conversation is kept once; the sampler upsamples it
+    conversations, n_original, n_feedback = _dedupe_conversations(
+        original_messages, feedback_messages
+    )
+    counts = {
         "original_train": len(original_train),
         "feedback": len(feedback_data),
-        "feedback_weight": feedback_weight,
-        "augmented_train": total_train,
+        "unique_train": len(conversations),
         "val": len(val_data),
     }
+    stats = _augmented_stats(counts, feedback_weight)
+
+    print(f"  Augmented training: {stats['augmented_train']} examples per epoch "
+          f"({len(original_train)} original + {len(feedback_data) * feedback_weight} feedback, "
+          f"{len(conversations)} unique)")
+
+    # Tokenize, streaming the messages chunk by chunk
+    train_dataset = train_7a.tokenize_conversations(conversations, tokenizer, max_length)
+    train_dataset = train_dataset.add_column("n_original", n_original)
+    train_dataset = train_dataset.add_column("n_feedback", n_feedback)
+    val_dataset = train_7a.tokenize_conversations(val_messages, tokenizer, max_length)
+
+    if use_cache:
+        train_7a.save_cached_datasets(cache_dir, train_dataset, val_dataset, counts)
 
     return train_dataset, val_dataset, stats
 
 
-def _tokenize(examples: dict, tokenizer, max_length: int) -> dict:
-    """Tokenize for causal LM."""
-    outputs = tokenizer(
-        examples["text"],
-        truncation=True,
-        max_length=max_length,
-        padding="max_length",
-        return_tensors=None,
-    )
-    outputs["labels"] = outputs["input_ids"].copy()
-    return outputs
+def _dedupe_conversations(
+    original_messages: Iterable[list[dict]],
+    feedback_messages: Iterable[list[dict]],
+) -> tuple[list[list[dict]], list[int], list[int]]:
+    """Collapse identical conversations, keyed by a hash of their messages.
+
+    Returns (conversations, n_original, n_feedback): the distinct
+    conversations in first-seen order, and how often each occurred in the
+    original and the feedback data.
+    """
+    rows: dict[bytes, int] = {}
+    conversations: list[list[dict]] = []
+    n_original: list[int] = []
+    n_feedback: list[int] = []
+    for occurrences, messages in ((n_original, original_messages), (n_feedback, feedback_messages)):
+        for conversation in messages:
+            key = hashlib.blake2b(
+                "\0".join(f"{m['role']}\0{m['content']}" for m in conversation).encode(),
+                digest_size=16,
+            ).digest()
+            row = rows.setdefault(key, len(conversations))
+            if row == len(conversations):
+                conversations.append(conversation)
+                n_original.append(0)
+                n_feedback.append(0)
+            occurrences[row] += 1
+    return conversations, n_original, n_feedback
+
+
+def _augmented_stats(counts: dict, feedback_weight: int) -> dict:
+    """Build the stats dict from example counts and the feedback weight."""
+    return {
+        "original_train": counts["original_train"],
+        "feedback": counts["feedback"],
+        "feedback_weight": feedback_weight,
+        "augmented_train": counts["original_train"] + counts["feedback"] * feedback_weight,
+        "unique_train": counts["unique_train"],
+        "val": counts["val"],
+    }
 
 
 def retrain(
     task: str,
     cycle: int,
     config: dict,
+    tokenizer,
     train_dataset,
     val_dataset,
+    stats: dict,
 ):
-    """Run retraining from Phase 7 adapter with augmented data."""
+    """Run retraining from Phase 7 adapter with augmented data.
+
+    tokenizer is the one main() loaded (with its pad token set) to build
+    the datasets.
+
+    Each row of train_dataset is drawn in proportion to its n_original
+    count plus stats["feedback_weight"] times its n_feedback count.
+    """
     import torch
+    from torch.utils.data import WeightedRandomSampler
     from peft import PeftModel, LoraConfig, get_peft_model, prepare_model_for_kbit_training
-    from transformers import (
-        AutoModelForCausalLM,
-        AutoTokenizer,
-        BitsAndBytesConfig,
-        Trainer,
-        TrainingArguments,
-    )
+    from transformers import BitsAndBytesConfig, Trainer, TrainingArguments
 
     model_name = config["model"]["base"]
     base_adapter = ML_ROOT / config.get("base_adapter_path", f"models/{task}_intent_to_asm/final")
     output_dir = ML_ROOT / config["output_dir"] / f"feedback_v{cycle}"
 
     print(f"\nLoading base model: {model_name}")
+    train_7a.check_qlora_config(config)
     quant_config = BitsAndBytesConfig(
         load_in_4bit=config["quantization"]["load_in_4bit"],
         bnb_4bit_quant_type=config["quantization"]["bnb_4bit_quant_type"],
@@ -211,29 +238,16 @@ def retrain(
         bnb_4bit_use_double_quant=config["quantization"]["bnb_4bit_use_double_quant"],
     )
 
-    model = AutoModelForCausalLM.from_pretrained(
-        model_name,
-        quantization_config=quant_config,
-        device_map="auto",
-        trust_remote_code=False,
-    )
-
-    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=False)
-    if tokenizer.pad_token is None:
-        tokenizer.pad_token = tokenizer.eos_token
-        model.config.pad_token_id = model.config.eos_token_id
+    model = train_7a.load_quantized_model(model_name, quant_config, config)
 
-    # Load Phase 7 adapter if it exists
-    if base_adapter.exists():
-        print(f"Loading Phase 7 adapter from: {base_adapter}")
-        model = PeftModel.from_pretrained(model, str(base_adapter))
-        # Merge adapter weights so we can apply new LoRA on top
-        model = model.merge_and_unload()
-        print("  Merged Phase 7 adapter into base model")
+    if model.config.pad_token_id is None:
+        model.config.pad_token_id = tokenizer.pad_token_id
 
-    # Prepare for new LoRA training
+    # Prepare the quantized base once, before any adapter is attached
     print("Preparing model for k-bit training...")
-    model = prepare_model_for_kbit_training(model)
+    model = prepare_model_for_kbit_training(
+        model, gradient_checkpointing_kwargs={"use_reentrant": False}
+    )
 
     lora_config = LoraConfig(
         r=config["lora"]["r"],
@@ -244,8 +258,24 @@ def retrain(
         task_type=config["lora"]["task_type"],
     )
 
-    print("Applying fresh LoRA...")
-    model = get_peft_model(model, lora_config)
+    # Stack a fresh "feedback" LoRA on the frozen Phase 7 adapter instead of
+    # merging it, which would dequantize and requantize every target module
+    if base_adapter.exists():
+        print(f"Loading Phase 7 adapter from: {base_adapter}")
+        model = PeftModel.from_pretrained(
+            model, str(base_adapter), adapter_name="phase7", is_trainable=False
+        )
+        print("Stacking fresh LoRA on frozen Phase 7 adapter...")
+        model.add_adapter("feedback", lora_config)
+        # Both adapters run in the forward pass; activating them marks both
+        # trainable, so freeze Phase 7 again
+        model.base_model.set_adapter(["phase7", "feedback"])
+        for name, param in model.named_parameters():
+            if ".phase7." in name:
+                param.requires_grad_(False)
+    else:
+        print("Applying fresh LoRA...")
+        model = get_peft_model(model, lora_config)
 
     trainable_params = sum(p.numel() for p in model.parameters() if p.requires_grad)
     total_params = sum(p.numel() for p in model.parameters())
@@ -265,27 +295,57 @@ def retrain(
         warmup_ratio=training_cfg["warmup_ratio"],
         weight_decay=training_cfg["weight_decay"],
         max_grad_norm=training_cfg["max_grad_norm"],
+        optim=training_cfg.get("optim", "paged_adamw_8bit"),
         eval_strategy="steps",
         eval_steps=training_cfg["eval_steps"],
         save_strategy="steps",
         save_steps=training_cfg["save_steps"],
         logging_steps=training_cfg["logging_steps"],
         save_total_limit=training_cfg["save_total_limit"],
+        save_safetensors=True,
         load_best_model_at_end=training_cfg["load_best_model_at_end"],
         metric_for_best_model=training_cfg["metric_for_best_model"],
         greater_is_better=training_cfg["greater_is_better"],
+        gradient_checkpointing=True,
+        gradient_checkpointing_kwargs={"use_reentrant": False},
         fp16=training_cfg["fp16"],
         bf16=training_cfg["bf16"],
         dataloader_num_workers=training_cfg["dataloader_num_workers"],
+        dataloader_pin_memory=True,
+        dataloader_persistent_workers=training_cfg["dataloader_num_workers"] > 0,
+        dataloader_prefetch_factor=(
+            training_cfg.get("dataloader_prefetch_factor")
+            if training_cfg["dataloader_num_workers"] > 0 else None
+        ),
+        torch_compile=training_cfg.get("compile", False) and train_7a.uses_flash_attention(model),
         remove_unused_columns=False,
         report_to="none",
     )
 
-    trainer = Trainer(
+    # Upsample duplicates and feedback through sampling weights instead of
+    # repeated rows. An epoch still draws original + weight * feedback examples.
+    occurrences = train_dataset.select_columns(["n_original", "n_feedback"]).with_format("torch")[:]
+    sample_weights = (
+        occurrences["n_original"] + stats["feedback_weight"] * occurrences["n_feedback"]
+    ).double()
+    train_dataset = train_dataset.remove_columns(["n_original", "n_feedback"])
+    uniform = bool((sample_weights == 1).all())
+    num_samples = stats["augmented_train"]
+
+    class FeedbackWeightedTrainer(Trainer):
+        """Trainer that draws training examples by occurrence and feedback weight."""
+
+        def _get_train_sampler(self, *args, **kwargs):
+            if uniform:
+                return super()._get_train_sampler(*args, **kwargs)
+            return WeightedRandomSampler(sample_weights, num_samples=num_samples, replacement=True)
+
+    trainer = FeedbackWeightedTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
+        data_collator=train_7a.create_data_collator(config, model, tokenizer),
     )
 
     print("\n" + "=" * 70)
@@ -294,10 +354,20 @@ def retrain(
 
     trainer.train()
 
-    # Save
+    # Save one self-contained adapter at final/, loadable like a Phase 7
+    # adapter. A stacked feedback LoRA only works on top of Phase 7, so fold
+    # both into one: "cat" concatenates their low-rank factors (rank r7 + r8,
+    # scaling folded into A), which reproduces the sum of the two deltas exactly.
     final_dir = output_dir / "final"
+    if base_adapter.exists():
+        model.add_weighted_adapter(
+            ["phase7", "feedback"], [1.0, 1.0],
+            adapter_name="default", combination_type="cat",
+        )
     print(f"\nSaving adapter to {final_dir}...")
-    trainer.model.save_pretrained(str(final_dir))
+    model.save_pretrained(
+        str(final_dir), selected_adapters=["default"], safe_serialization=True
+    )
     tokenizer.save_pretrained(str(final_dir))
 
     # Report
@@ -316,6 +386,8 @@ def retrain(
             print(f"  Best eval loss:   {min(eval_losses):.4f}")
 
     print(f"\n  Adapter saved to: {final_dir}")
+    if base_adapter.exists():
+        print(f"  Includes:         {base_adapter}")
     print("=" * 70)
 
     return final_dir
@@ -345,6 +417,10 @@ def main():
         "--dry-run", action="store_true",
         help="Show data stats without training",
     )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Re-tokenize datasets instead of using the cached Arrow copy",
+    )
     args = parser.parse_args()
 
     # Select config
@@ -355,11 +431,9 @@ def main():
     print(f"Loading config: {config_path}")
     config = load_config(config_path)
 
-    # Load tokenizer for formatting
+    # Load tokenizer once, for formatting and training
     print("Loading tokenizer...")
-    from transformers import AutoTokenizer
-    model_name = config["model"]["base"]
-    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=False)
+    tokenizer = train_7a.load_tokenizer(config["model"]["base"])
     if tokenizer.pad_token is None:
         tokenizer.pad_token = tokenizer.eos_token
 
@@ -368,7 +442,8 @@ def main():
     # Prepare augmented data
     print(f"\nPreparing augmented data for {args.task}...")
     train_dataset, val_dataset, stats = prepare_augmented_data(
-        args.task, args.feedback_weight, tokenizer, max_length
+        args.task, args.feedback_weight, tokenizer, max_length,
+        use_cache=not args.no_cache,
     )
 
     if args.dry_run:
@@ -381,6 +456,7 @@ def main():
         print(f"  Feedback examples: {stats['feedback']}")
         print(f"  Feedback weight:   {stats['feedback_weight']}x")
         print(f"  Augmented train:   {stats['augmented_train']}")
+        print(f"  Unique train:      {stats['unique_train']}")
         print(f"  Validation:        {stats['val']}")
         print(f"  Config:            {config_path}")
         print(f"  Learning rate:     {config['training']['learning_rate']}")
@@ -393,7 +469,8 @@ def main():
         print("\nWARNING: No feedback examples found. Training on original data only.")
         print("This is equivalent to another epoch of Phase 7 training with conservative LR.")
 
-    retrain(args.task, args.cycle, config, train_dataset, val_dataset)
+    train_7a.enable_tf32()
+    retrain(args.task, args.cycle, config, tokenizer, train_dataset, val_dataset, stats)
 
 
 if __name__ == "__main__":
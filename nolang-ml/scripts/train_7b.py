@@ -12,8 +12,6 @@ Usage:
 """
 
 import argparse
-import json
-import sys
 from pathlib import Path
 from typing import Dict, List, Any
 
@@ -21,8 +19,6 @@ import torch
 import yaml
 from datasets import Dataset
 from transformers import (
-    AutoModelForCausalLM,
-    AutoTokenizer,
     BitsAndBytesConfig,
     Trainer,
     TrainingArguments,
@@ -33,6 +29,8 @@ from peft import (
     prepare_model_for_kbit_training,
 )
 
+import train_7a
+
 
 # System prompt for assembly → description task
 SYSTEM_PROMPT = (
@@ -41,6 +39,14 @@ SYSTEM_PROMPT = (
     "Do NOT explain syntax. Describe what the code DOES, not what it was INTENDED to do."
 )
 
+# User message for an example, formatted with its fields
+USER_TEMPLATE = "Assembly:\n{assembly}"
+
+# Stand-ins for the per-example contents when the chat template is rendered
+# once (private-use characters, so they cannot clash with template text)
+_USER_SLOT = "\ue000user\ue000"
+_ASSISTANT_SLOT = "\ue000assistant\ue000"
+
 
 def load_config(config_path: Path) -> Dict[str, Any]:
     """Load YAML configuration file."""
@@ -51,64 +57,156 @@ def load_config(config_path: Path) -> Dict[str, Any]:
         return yaml.safe_load(f)
 
 
-def load_jsonl(path: Path) -> List[Dict[str, str]]:
-    """Load JSONL file as list of dicts."""
+def load_jsonl(path: Path) -> Dataset:
+    """
+    Load JSONL file as an Arrow-backed Dataset.
+
+    The datasets JSON loader parses the file into a memory-mapped Arrow
+    table, so examples are held as column buffers rather than a list of
+    Python dicts for the whole run.
+    """
     if not path.exists():
         raise FileNotFoundError(f"Data file not found: {path}")
 
-    data = []
-    with open(path) as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                data.append(json.loads(line))
-    return data
+    return Dataset.from_json(str(path))
 
 
-def format_chat_prompt(example: Dict[str, str], tokenizer) -> str:
+def build_messages(example: Dict[str, str]) -> List[Dict[str, str]]:
     """
-    Format a single example as a chat completion using Llama 3.1 chat template.
+    Build the chat messages for a single example.
 
     Args:
         example: Dict with 'assembly' and 'description' keys
-        tokenizer: HuggingFace tokenizer with chat template
 
     Returns:
-        Formatted string ready for tokenization
+        System, user and assistant messages
     """
-    messages = [
+    return [
         {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": f"Assembly:\n{example['assembly']}"},
+        {"role": "user", "content": USER_TEMPLATE.format(**example)},
         {"role": "assistant", "content": example['description']},
     ]
 
-    # Apply chat template with tokenize=False to get the formatted string
+
+def _render_slots(tokenizer, slots: List[str], prompt_only: bool) -> str:
+    """Render the chat template with slots as the user/assistant contents."""
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    messages += [
+        {"role": role, "content": slot}
+        for role, slot in zip(("user", "assistant"), slots)
+    ]
     return tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=False,
+        messages, tokenize=False, add_generation_prompt=prompt_only
     )
 
 
-def tokenize_dataset(
+def _split_slots(text: str, slots: List[str]) -> List[str] | None:
+    """Split text around each slot in order, or None if one is missing."""
+    pieces = []
+    for slot in slots:
+        head, found, text = text.partition(slot)
+        if not found:
+            return None
+        pieces.append(head)
+    pieces.append(text)
+    return pieces
+
+
+def chat_skeleton(tokenizer, prompt_only: bool = False) -> tuple[List[str], bool] | None:
+    """
+    Render the chat template once, around placeholder contents.
+
+    The system prompt is fixed, so everything except the user and assistant
+    contents is the same for every example. The template is rendered a
+    second time with whitespace around the placeholders to tell whether it
+    passes contents through as-is or strips them (Llama 3.1 applies Jinja's
+    trim, which is str.strip).
+
+    Args:
+        tokenizer: HuggingFace tokenizer with chat template
+        prompt_only: Leave out the assistant turn and end at its header
+
+    Returns:
+        (pieces, strip): the literal text before, between and after the user
+        (and assistant) contents, and whether contents must be stripped
+        first; None if the template rewrites contents in any other way
+    """
+    slots = [_USER_SLOT] if prompt_only else [_USER_SLOT, _ASSISTANT_SLOT]
+    text = _render_slots(tokenizer, slots, prompt_only)
+    pieces = _split_slots(text, slots)
+    if pieces is None:
+        return None
+
+    padded_slots = [f"\n {slot} \n" for slot in slots]
+    padded_text = _render_slots(tokenizer, padded_slots, prompt_only)
+    if _split_slots(padded_text, padded_slots) == pieces:
+        return pieces, False
+    if padded_text == text:
+        return pieces, True
+    return None
+
+
+def format_chat_prompts(
     examples: List[Dict[str, str]],
     tokenizer,
-    max_length: int,
-) -> Dataset:
+    prompt_only: bool = False,
+) -> List[str]:
     """
-    Tokenize dataset for causal language modeling.
+    Format examples as chat completions using Llama 3.1 chat template.
+
+    The template is rendered once by chat_skeleton and each example is
+    spliced into it, so Jinja does not run per example. Templates that
+    rewrite message content go through one batched template call instead.
 
     Args:
-        examples: List of dicts with 'assembly' and 'description'
-        tokenizer: HuggingFace tokenizer
-        max_length: Maximum sequence length
+        examples: List of dicts with 'assembly' and 'description' keys
+        tokenizer: HuggingFace tokenizer with chat template
+        prompt_only: Leave out the description and end at the assistant header
 
     Returns:
-        HuggingFace Dataset ready for training
+        Formatted strings ready for tokenization
     """
-    formatted_texts = [format_chat_prompt(ex, tokenizer) for ex in examples]
+    if not examples:
+        return []
+
+    skeleton = chat_skeleton(tokenizer, prompt_only)
+    if skeleton is not None:
+        pieces, strip = skeleton
+        contents = [
+            [USER_TEMPLATE.format(**ex)] + ([] if prompt_only else [ex["description"]])
+            for ex in examples
+        ]
+        if strip:
+            contents = [[c.strip() for c in parts] for parts in contents]
+        if prompt_only:
+            head, tail = pieces
+            return [head + user + tail for (user,) in contents]
+        head, middle, tail = pieces
+        return [head + user + middle + desc + tail for user, desc in contents]
+
+    conversations = [build_messages(ex) for ex in examples]
+    if prompt_only:
+        conversations = [messages[:-1] for messages in conversations]
+
+    # Apply chat template with tokenize=False to get the formatted strings
+    return tokenizer.apply_chat_template(
+        conversations,
+        tokenize=False,
+        add_generation_prompt=prompt_only,
+    )
+
 
-    # Tokenize all at once for efficiency
+def _tokenize_batch(
+    batch: Dict[str, List[Any]],
+    tokenizer,
+    max_length: int,
+) -> Dict[str, List[Any]]:
+    """Tokenize one batch of examples (as columns) with prompt-masked labels."""
+    examples = [dict(zip(batch, row)) for row in zip(*batch.values())]
+    formatted_texts = format_chat_prompts(examples, tokenizer)
+    prompt_texts = format_chat_prompts(examples, tokenizer, prompt_only=True)
+
+    # Tokenize the whole batch in one call
     tokenized = tokenizer(
         formatted_texts,
         truncation=True,
@@ -117,11 +215,56 @@ def tokenize_dataset(
         return_tensors=None,  # Return lists, not tensors
     )
 
-    # For causal LM, labels are the same as input_ids
-    # Trainer will handle shifting and loss masking
-    tokenized["labels"] = tokenized["input_ids"].copy()
+    prompt_ids = tokenizer(
+        prompt_texts,
+        truncation=True,
+        max_length=max_length,
+        return_tensors=None,
+    )["input_ids"]
+
+    # For causal LM, labels are the same as input_ids, with the system and
+    # user prompt set to -100 so only the description contributes to the loss
+    labels = []
+    for text, prompt, ids, prompt_tokens in zip(
+        formatted_texts, prompt_texts, tokenized["input_ids"], prompt_ids
+    ):
+        n_prompt = len(prompt_tokens) if text.startswith(prompt) else 0
+        labels.append([-100] * min(n_prompt, len(ids)) + ids[n_prompt:])
+    tokenized["labels"] = labels
+    # Read by the group_by_length sampler instead of re-measuring every row
+    tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
+
+    return dict(tokenized)
+
+
+def tokenize_dataset(
+    examples: Dataset,
+    tokenizer,
+    max_length: int,
+) -> Dataset:
+    """
+    Tokenize dataset for causal language modeling.
+
+    Examples are tokenized in batches straight from the Arrow table and the
+    source columns are dropped, so only one batch of texts is in Python
+    objects at a time.
 
-    return Dataset.from_dict(tokenized)
+    Args:
+        examples: Dataset with 'assembly' and 'description' columns
+        tokenizer: HuggingFace tokenizer
+        max_length: Maximum sequence length
+
+    Returns:
+        HuggingFace Dataset ready for training
+    """
+    return examples.map(
+        _tokenize_batch,
+        batched=True,
+        batch_size=10_000,
+        remove_columns=examples.column_names,
+        fn_kwargs={"tokenizer": tokenizer, "max_length": max_length},
+        desc="Tokenizing",
+    )
 
 
 def create_bnb_config(config: Dict[str, Any]) -> BitsAndBytesConfig:
@@ -153,8 +296,20 @@ def create_lora_config(config: Dict[str, Any]) -> LoraConfig:
     )
 
 
-def create_training_args(config: Dict[str, Any], output_dir: Path) -> TrainingArguments:
-    """Create training arguments from YAML config."""
+def create_training_args(
+    config: Dict[str, Any], output_dir: Path, torch_compile: bool = False
+) -> TrainingArguments:
+    """
+    Create training arguments from YAML config.
+
+    Args:
+        config: Full YAML config
+        output_dir: Checkpoint directory
+        torch_compile: Compile the LoRA-wrapped model with inductor
+
+    Returns:
+        TrainingArguments for the Trainer
+    """
     train_cfg = config["training"]
 
     return TrainingArguments(
@@ -168,18 +323,35 @@ def create_training_args(config: Dict[str, Any], output_dir: Path) -> TrainingAr
         warmup_ratio=train_cfg["warmup_ratio"],
         weight_decay=train_cfg["weight_decay"],
         max_grad_norm=train_cfg["max_grad_norm"],
+        optim=train_cfg.get("optim", "paged_adamw_8bit"),
         eval_strategy="steps",
         eval_steps=train_cfg["eval_steps"],
         save_strategy="steps",
         save_steps=train_cfg["save_steps"],
         logging_steps=train_cfg["logging_steps"],
         save_total_limit=train_cfg["save_total_limit"],
+        save_safetensors=True,
         load_best_model_at_end=train_cfg["load_best_model_at_end"],
         metric_for_best_model=train_cfg["metric_for_best_model"],
         greater_is_better=train_cfg["greater_is_better"],
+        # Recompute activations in backward so larger micro-batches fit
+        gradient_checkpointing=True,
+        gradient_checkpointing_kwargs={"use_reentrant": False},
         fp16=train_cfg["fp16"],
         bf16=train_cfg["bf16"],
         dataloader_num_workers=train_cfg["dataloader_num_workers"],
+        # Pinned host memory makes batch copies to the GPU asynchronous;
+        # persistent workers skip re-spawning (and re-importing) each epoch
+        dataloader_pin_memory=True,
+        dataloader_persistent_workers=train_cfg["dataloader_num_workers"] > 0,
+        # Batches each worker keeps ready ahead of the GPU (workers only)
+        dataloader_prefetch_factor=(
+            train_cfg.get("dataloader_prefetch_factor")
+            if train_cfg["dataloader_num_workers"] > 0 else None
+        ),
+        torch_compile=torch_compile,
+        group_by_length=True,  # Batch similar lengths to cut padding
+        length_column_name="length",  # Precomputed in tokenize_dataset
         remove_unused_columns=False,  # Keep all columns
         report_to="none",  # Disable wandb/tensorboard for now
     )
@@ -187,8 +359,8 @@ def create_training_args(config: Dict[str, Any], output_dir: Path) -> TrainingAr
 
 def print_dry_run_info(
     config: Dict[str, Any],
-    train_data: List[Dict[str, str]],
-    val_data: List[Dict[str, str]],
+    train_data: Dataset,
+    val_data: Dataset,
     output_dir: Path,
 ):
     """Print configuration and dataset info for dry run."""
@@ -295,10 +467,12 @@ def main():
     print("=" * 80)
     print()
 
+    train_7a.enable_tf32()
+
     # Step 1: Load tokenizer
     print("Step 1/6: Loading tokenizer...")
     model_name = config["model"]["base"]
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    tokenizer = train_7a.load_tokenizer(model_name)
 
     # Ensure pad token is set (Llama models don't have one by default)
     if tokenizer.pad_token is None:
@@ -315,29 +489,22 @@ def main():
 
     # Step 3: Load base model with quantization
     print("Step 3/6: Loading base model with 4-bit quantization...")
+    train_7a.check_qlora_config(config)
     bnb_config = create_bnb_config(config)
 
     try:
-        model = AutoModelForCausalLM.from_pretrained(
-            model_name,
-            quantization_config=bnb_config,
-            device_map="auto",
-            trust_remote_code=True,
-        )
+        model = train_7a.load_quantized_model(model_name, bnb_config, config)
     except Exception as e:
         print(f"Failed to load {model_name}: {e}")
         fallback = config["model"]["fallback"]
         print(f"Falling back to {fallback}")
-        model = AutoModelForCausalLM.from_pretrained(
-            fallback,
-            quantization_config=bnb_config,
-            device_map="auto",
-            trust_remote_code=True,
-        )
+        model = train_7a.load_quantized_model(fallback, bnb_config, config)
 
     # Step 4: Prepare model for k-bit training
     print("Step 4/6: Preparing model for k-bit training...")
-    model = prepare_model_for_kbit_training(model)
+    model = prepare_model_for_kbit_training(
+        model, gradient_checkpointing_kwargs={"use_reentrant": False}
+    )
 
     # Step 5: Add LoRA adapters
     print("Step 5/6: Adding LoRA adapters...")
@@ -352,7 +519,10 @@ def main():
 
     # Step 6: Train
     print("Step 6/6: Starting training...")
-    training_args = create_training_args(config, output_dir)
+    # Compile only on top of flash attention; batch shapes vary per step,
+    # so use the default mode rather than CUDA-graph capture
+    torch_compile = config["training"].get("compile", False) and train_7a.uses_flash_attention(model)
+    training_args = create_training_args(config, output_dir, torch_compile=torch_compile)
 
     trainer = Trainer(
         model=model,
@@ -360,6 +530,7 @@ def main():
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
         tokenizer=tokenizer,
+        data_collator=train_7a.create_data_collator(config, model, tokenizer),
     )
 
     # Train and save
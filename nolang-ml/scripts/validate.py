@@ -1,27 +1,37 @@
 #!/usr/bin/env python3
 """Validation pipeline for LLM-generated NoLang assembly.
 
-Calls the Rust CLI to:
-1. Normalize HASH placeholders
-2. Compute correct hashes via `nolang hash`
-3. Patch hashes into assembly
-4. Assemble text → binary
-5. Verify binary
-6. Optionally run witness tests
+Normalizes HASH placeholders, then makes one `nolang validate` call per
+program, which:
+1. Computes correct hashes (patched back into the assembly text here)
+2. Assembles the text
+3. Verifies the program
+4. Optionally runs witness tests
 
 Usage:
     from validate import validate_assembly
     result = validate_assembly("FUNC 1 3\nPARAM I64\nREF 0\nRET\nHASH 0x0000 0x0000 0x0000\nENDFUNC\nCONST I64 0x0000 0x002a\nCALL 0\nHALT")
 """
 
+import hashlib
 import json
 import os
+import queue
 import re
 import subprocess
 import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
+
 SCRIPT_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = SCRIPT_DIR.parent.parent  # nolang-ml/../ = nol/
 
@@ -40,6 +50,12 @@ if _NOLANG_BIN is None:
     import shutil
     _NOLANG_BIN = shutil.which("nolang")
 
+# Scratch directory for the short-lived files handed to the CLI — prefer
+# RAM-backed /dev/shm over a disk-backed /tmp. NOLANG_TMP overrides.
+TMP_DIR = os.environ.get("NOLANG_TMP") or (
+    "/dev/shm" if os.path.isdir("/dev/shm") else None
+)
+
 
 def get_nolang_bin() -> str:
     """Return path to nolang CLI binary, raising if not found."""
@@ -56,6 +72,54 @@ HASH_LINE_RE = re.compile(r"^HASH\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA-F]+\s+0x[0-9a-fA
 HASH_PLACEHOLDER = "HASH 0x0000 0x0000 0x0000"
 
 
+def _compile_hash_line_db():
+    """Compile HASH_LINE_RE into a Hyperscan database, if available.
+
+    \\s is spelled out as the ASCII characters Python's re treats as
+    whitespace, so on ASCII text both engines match the same lines.
+    """
+    if hyperscan is None:
+        return None
+    pattern = HASH_LINE_RE.pattern.replace(r"\s", r"[\t\n\x0b\x0c\r\x1c-\x1f ]")
+    db = hyperscan.Database()
+    db.compile(
+        expressions=[pattern.encode()],
+        ids=[0],
+        elements=1,
+        flags=[hyperscan.HS_FLAG_MULTILINE | hyperscan.HS_FLAG_SOM_LEFTMOST],
+    )
+    return db
+
+
+_HASH_LINE_DB = _compile_hash_line_db()
+# Hyperscan scratch space is per scan, so each validation thread gets its own
+_hs_local = threading.local()
+
+
+def hash_line_spans(text: str) -> list[tuple[int, int]]:
+    """Return (start, end) offsets of every HASH line in text, in order.
+
+    With hyperscan installed, ASCII text (all generated assembly) is
+    scanned in one DFA pass; anything else goes through HASH_LINE_RE. A
+    line can match the pattern in only one way, so hyperscan's
+    report-every-match semantics give the same spans as re.finditer.
+    """
+    if "HASH" not in text:
+        return []
+    if _HASH_LINE_DB is not None and text.isascii():
+        scratch = getattr(_hs_local, "scratch", None)
+        if scratch is None:
+            scratch = _hs_local.scratch = hyperscan.Scratch(_HASH_LINE_DB)
+        spans = []
+        _HASH_LINE_DB.scan(
+            text.encode(),
+            match_event_handler=lambda _id, start, end, *_: spans.append((start, end)),
+            scratch=scratch,
+        )
+        return spans
+    return [m.span() for m in HASH_LINE_RE.finditer(text)]
+
+
 @dataclass
 class ValidationResult:
     """Result of validating a generated assembly program."""
@@ -67,7 +131,6 @@ class ValidationResult:
     witnesses_total: int = 0
     witnesses_ok: int = 0
     errors: list[str] = field(default_factory=list)
-    binary_path: str | None = None
 
     @property
     def fully_valid(self) -> bool:
@@ -84,10 +147,13 @@ class ValidationResult:
         }
 
 
-def _run_cmd(args: list[str], timeout: float = 30.0) -> subprocess.CompletedProcess:
-    """Run a subprocess with timeout."""
+def _run_cmd(
+    args: list[str], timeout: float = 30.0, input: str | None = None
+) -> subprocess.CompletedProcess:
+    """Run a subprocess with timeout, optionally feeding input on stdin."""
     return subprocess.run(
         args,
+        input=input,
         capture_output=True,
         text=True,
         timeout=timeout,
@@ -96,112 +162,67 @@ def _run_cmd(args: list[str], timeout: float = 30.0) -> subprocess.CompletedProc
 
 def normalize_hashes(assembly: str) -> str:
     """Replace all HASH lines with placeholder values."""
-    return HASH_LINE_RE.sub(HASH_PLACEHOLDER, assembly)
-
-
-def compute_hashes(assembly: str) -> str | None:
-    """Run `nolang hash` on assembly, return output with correct hash lines.
-
-    The `nolang hash` command reads a .nol file and outputs one HASH line
-    per FUNC block (in order), with correct values computed via blake3.
+    spans = hash_line_spans(assembly)
+    if not spans:
+        return assembly
+    parts = []
+    last = 0
+    for start, end in spans:
+        parts.append(assembly[last:start])
+        parts.append(HASH_PLACEHOLDER)
+        last = end
+    parts.append(assembly[last:])
+    return "".join(parts)
+
+
+def run_validate(assembly: str, witnesses: list[dict] | None = None) -> dict | None:
+    """Run `nolang validate` on assembly, return its per-stage JSON report.
+
+    One CLI process recomputes the hashes, assembles, verifies and (given
+    witnesses) runs the witness tests, keeping the program in memory
+    between stages. The assembly is piped on stdin; only the witnesses go
+    through a temp file under TMP_DIR. Returns None if the CLI produced no
+    report.
     """
-    nolang = get_nolang_bin()
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".nol", delete=False
-    ) as f:
-        f.write(assembly)
-        tmp_path = f.name
+    args = [get_nolang_bin(), "validate", "-"]
+    if witnesses:
+        with tempfile.NamedTemporaryFile(
+            mode="w", suffix=".json", dir=TMP_DIR
+        ) as f:
+            json.dump(witnesses, f)
+            f.flush()
+            result = _run_cmd(args + ["--witnesses", f.name], input=assembly)
+    else:
+        result = _run_cmd(args, input=assembly)
 
     try:
-        result = _run_cmd([nolang, "hash", tmp_path])
-        if result.returncode != 0:
-            return None
-        return result.stdout
-    finally:
-        os.unlink(tmp_path)
+        return json.loads(result.stdout)
+    except json.JSONDecodeError:
+        return None
 
 
 def patch_hashes(original: str, hashed_output: str) -> str:
     """Patch correct HASH values from nolang hash output into the assembly.
 
     Strategy: find all HASH lines in original and hashed_output, replace
-    in order (FUNC blocks are in the same order).
+    in order (FUNC blocks are in the same order). The output is rebuilt in
+    one pass over the original's matches.
     """
-    original_hashes = HASH_LINE_RE.findall(original)
-    correct_hashes = HASH_LINE_RE.findall(hashed_output)
+    original_spans = hash_line_spans(original)
+    correct_spans = hash_line_spans(hashed_output)
 
-    if len(original_hashes) != len(correct_hashes):
+    if len(original_spans) != len(correct_spans):
         # Mismatched FUNC count — return hashed output directly
         return hashed_output
 
-    result = original
-    for old_hash, new_hash in zip(original_hashes, correct_hashes):
-        result = result.replace(old_hash, new_hash, 1)
-    return result
-
-
-def assemble(assembly: str) -> tuple[bool, str | None, str]:
-    """Assemble text to binary, return (success, binary_path, error_msg)."""
-    nolang = get_nolang_bin()
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".nol", delete=False
-    ) as f:
-        f.write(assembly)
-        nol_path = f.name
-
-    nolb_path = nol_path.replace(".nol", ".nolb")
-
-    try:
-        result = _run_cmd([nolang, "assemble", nol_path, "-o", nolb_path])
-        if result.returncode == 0 and os.path.exists(nolb_path):
-            return True, nolb_path, ""
-        error = result.stderr.strip() or result.stdout.strip()
-        return False, None, error
-    finally:
-        os.unlink(nol_path)
-
-
-def verify(binary_path: str) -> tuple[bool, str]:
-    """Verify a binary program, return (success, error_msg)."""
-    nolang = get_nolang_bin()
-    result = _run_cmd([nolang, "verify", binary_path])
-    if result.returncode == 0:
-        return True, ""
-    error = result.stderr.strip() or result.stdout.strip()
-    return False, error
-
-
-def run_witnesses(
-    binary_path: str, witnesses: list[dict]
-) -> tuple[int, int, list[str]]:
-    """Run witness tests, return (total, passed, errors)."""
-    if not witnesses:
-        return 0, 0, []
-
-    nolang = get_nolang_bin()
-
-    # Write witness file
-    with tempfile.NamedTemporaryFile(
-        mode="w", suffix=".json", delete=False
-    ) as f:
-        json.dump(witnesses, f)
-        wit_path = f.name
-
-    try:
-        result = _run_cmd([nolang, "witness", binary_path, wit_path])
-        total = len(witnesses)
-        if result.returncode == 0:
-            return total, total, []
-        # Parse partial results from output
-        errors = [result.stderr.strip() or result.stdout.strip()]
-        # Try to count passes from output
-        passed = 0
-        for line in result.stdout.split("\n"):
-            if "PASS" in line.upper():
-                passed += 1
-        return total, passed, errors
-    finally:
-        os.unlink(wit_path)
+    parts = []
+    last = 0
+    for (start, end), (new_start, new_end) in zip(original_spans, correct_spans):
+        parts.append(original[last:start])
+        parts.append(hashed_output[new_start:new_end])
+        last = end
+    parts.append(original[last:])
+    return "".join(parts)
 
 
 def validate_assembly(
@@ -211,84 +232,260 @@ def validate_assembly(
     """Full validation pipeline for generated assembly.
 
     1. Normalize HASH placeholders
-    2. Compute correct hashes via nolang hash
+    2. Compute correct hashes
     3. Patch hashes
     4. Assemble
     5. Verify
     6. Optionally run witnesses
+
+    Steps 2 and 4-6 run in a single `nolang validate` call.
     """
+    return _validate(assembly, witnesses, run_validate)
+
+
+# CLI reports keyed by a digest of (normalized assembly, witnesses). Sampled
+# batches repeat programs that differ only in their HASH lines; those
+# normalize to the same text and skip the CLI round-trip. Least recently used
+# entries are evicted first once the cache is full. BatchValidator threads
+# share the cache, so every access holds _report_cache_lock.
+REPORT_CACHE_SIZE = 65536
+_report_cache: OrderedDict[bytes, dict] = OrderedDict()
+_report_cache_lock = threading.Lock()
+
+
+def _cached_report(
+    normalized: str,
+    witnesses: list[dict] | None,
+    run: Callable[[str, list[dict] | None], dict | None],
+) -> dict | None:
+    """Return run(normalized, witnesses), reusing the report for repeats."""
+    key = hashlib.blake2b(digest_size=16)
+    key.update(normalized.encode())
+    if witnesses:
+        key.update(b"\0")
+        key.update(json.dumps(witnesses, sort_keys=True).encode())
+    key = key.digest()
+
+    with _report_cache_lock:
+        report = _report_cache.get(key)
+        if report is not None:
+            _report_cache.move_to_end(key)
+            return report
+
+    # The CLI round-trip runs unlocked so other threads keep validating
+    report = run(normalized, witnesses)
+    # A timeout may come from machine load rather than the program, so skip it
+    if report is not None and "timeout" not in report:
+        with _report_cache_lock:
+            _report_cache[key] = report
+            if len(_report_cache) > REPORT_CACHE_SIZE:
+                _report_cache.popitem(last=False)
+    return report
+
+
+def _validate(
+    assembly: str,
+    witnesses: list[dict] | None,
+    run: Callable[[str, list[dict] | None], dict | None],
+) -> ValidationResult:
+    """Validate assembly, with run(normalized, witnesses) producing the CLI report."""
     result = ValidationResult(assembly=assembly)
 
     # Step 1: Normalize hashes
     normalized = normalize_hashes(assembly)
+    result.assembly = normalized
+
+    report = _cached_report(normalized, witnesses, run)
+    if report is None:
+        result.errors.append("validation failed (nolang validate returned no report)")
+        return result
+    if "timeout" in report:
+        result.errors.append(f"validation timed out after {report['timeout']:g}s")
+        return result
 
-    # Step 2: Compute correct hashes (only if HASH lines present)
+    # Steps 2-3: Patch computed hashes (only if HASH lines present); they are
+    # null when the program does not assemble or fails the structural check
     if HASH_PLACEHOLDER in normalized:
-        hashed_output = compute_hashes(normalized)
-        if hashed_output is None:
+        if report["hashes"] is None:
             result.errors.append("hash computation failed (nolang hash returned error)")
-            result.assembly = normalized
             return result
-        # Step 3: Patch
-        patched = patch_hashes(normalized, hashed_output)
-        result.assembly = patched
+        result.assembly = patch_hashes(normalized, "\n".join(report["hashes"]))
         result.hash_patched = True
-    else:
-        result.assembly = normalized
 
     # Step 4: Assemble
-    ok, binary_path, error = assemble(result.assembly)
-    result.assembled = ok
-    if not ok:
-        result.errors.append(f"assembly failed: {error}")
+    result.assembled = report["assembled"]
+    if not result.assembled:
+        result.errors.append(f"assembly failed: {report['assemble_error']}")
         return result
-    result.binary_path = binary_path
 
     # Step 5: Verify
-    ok, error = verify(binary_path)
-    result.verified = ok
-    if not ok:
-        result.errors.append(f"verification failed: {error}")
+    result.verified = report["verified"]
+    if not result.verified:
+        result.errors.append(f"verification failed: {report['verify_error']}")
 
     # Step 6: Witnesses
-    if witnesses and binary_path:
-        total, passed, wit_errors = run_witnesses(binary_path, witnesses)
-        result.witnesses_total = total
-        result.witnesses_ok = passed
-        result.witnesses_passed = (passed == total)
-        result.errors.extend(wit_errors)
-
-    # Cleanup binary
-    if binary_path and os.path.exists(binary_path):
-        os.unlink(binary_path)
-        result.binary_path = None
+    if witnesses:
+        result.witnesses_total = len(witnesses)
+        result.witnesses_ok = report["witnesses_ok"]
+        result.witnesses_passed = (result.witnesses_ok == result.witnesses_total)
+        if report["witness_error"]:
+            result.errors.append(report["witness_error"])
 
     return result
 
 
+class _ValidateServer:
+    """One long-lived `nolang serve` process, answering a JSON line per request.
+
+    If the process dies, hangs past the timeout or answers with something
+    that is not JSON, that request gets no report (a timeout report if it
+    hung) and a fresh process is started for the next one.
+    """
+
+    def __init__(self, timeout: float = 30.0):
+        self.timeout = timeout
+        self._start()
+
+    def _start(self) -> None:
+        self._proc = subprocess.Popen(
+            [get_nolang_bin(), "serve"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            encoding="utf-8",
+        )
+
+    def request(self, assembly: str, witnesses: list[dict] | None) -> dict | None:
+        """Send one program to the server and return its validation report."""
+        # Raw UTF-8 rather than \u escapes, so characters outside the BMP
+        # are not split into surrogate pairs
+        line = json.dumps({
+            "assembly": assembly,
+            "witnesses": json.dumps(witnesses, ensure_ascii=False) if witnesses else None,
+        }, ensure_ascii=False)
+        # Killing a hung server unblocks the readline below with EOF
+        timed_out = threading.Event()
+        proc = self._proc
+
+        def expire() -> None:
+            timed_out.set()
+            proc.kill()
+
+        watchdog = threading.Timer(self.timeout, expire)
+        watchdog.start()
+        try:
+            proc.stdin.write(line + "\n")
+            proc.stdin.flush()
+            reply = proc.stdout.readline()
+        except OSError:
+            reply = ""
+        finally:
+            watchdog.cancel()
+
+        report = None
+        if reply:
+            try:
+                report = json.loads(reply)
+            except json.JSONDecodeError:
+                pass
+        if report is None or timed_out.is_set():
+            self.close()
+            self._start()
+        if report is None and timed_out.is_set():
+            return {"timeout": self.timeout}
+        return report
+
+    def close(self) -> None:
+        """Close stdin so the server exits, and reap it."""
+        try:
+            self._proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+
+class BatchValidator:
+    """Validate many programs through a pool of persistent `nolang serve` processes.
+
+    The servers are started once on entry and reused for every call to
+    validate_many, so process startup is paid once per worker rather than
+    once per program, and programs and reports travel over pipes instead
+    of temp files. Worker threads only shuttle lines to and from the
+    servers, which do the validation work in parallel.
+
+    Usage:
+        with BatchValidator(max_workers=8) as validator:
+            results = validator.validate_many([(asm, witnesses), ...])
+    """
+
+    def __init__(self, max_workers: int | None = None, timeout: float = 30.0):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self._servers: queue.SimpleQueue[_ValidateServer] | None = None
+        self._all_servers: list[_ValidateServer] = []
+        self._executor: ThreadPoolExecutor | None = None
+
+    def __enter__(self) -> "BatchValidator":
+        self._all_servers = [
+            _ValidateServer(self.timeout) for _ in range(self.max_workers)
+        ]
+        self._servers = queue.SimpleQueue()
+        for server in self._all_servers:
+            self._servers.put(server)
+        if self.max_workers > 1:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        for server in self._all_servers:
+            server.close()
+        self._all_servers = []
+        self._servers = None
+
+    def _validate_item(self, item: tuple[str, list[dict] | None]) -> ValidationResult:
+        """Validate one (assembly, witnesses) pair on an idle server."""
+        assembly, witnesses = item
+        server = self._servers.get()
+        try:
+            return _validate(assembly, witnesses, server.request)
+        finally:
+            self._servers.put(server)
+
+    def imap(
+        self, items: Iterable[tuple[str, list[dict] | None]]
+    ) -> Iterator[ValidationResult]:
+        """Yield results for (assembly, witnesses) pairs in input order as they complete.
+
+        Items are dispatched one at a time to whichever server is idle.
+        """
+        if self._servers is None:
+            raise RuntimeError("BatchValidator must be used as a context manager")
+        if self._executor is None:
+            return map(self._validate_item, items)
+        return self._executor.map(self._validate_item, items)
+
+    def validate_many(
+        self, items: list[tuple[str, list[dict] | None]]
+    ) -> list[ValidationResult]:
+        """Validate (assembly, witnesses) pairs, returning results in input order."""
+        return list(self.imap(items))
+
+
 def validate_batch(
     items: list[dict],
     max_workers: int = 4,
 ) -> list[ValidationResult]:
     """Validate a batch of generated assemblies in parallel."""
-    from concurrent.futures import ProcessPoolExecutor, as_completed
-
-    results = [None] * len(items)
-
-    def _validate_one(idx: int, item: dict) -> tuple[int, ValidationResult]:
-        witnesses = item.get("witnesses")
-        return idx, validate_assembly(item["assembly"], witnesses)
-
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {
-            executor.submit(_validate_one, i, item): i
-            for i, item in enumerate(items)
-        }
-        for future in as_completed(futures):
-            idx, vr = future.result()
-            results[idx] = vr
-
-    return results
+    with BatchValidator(max_workers=max_workers) as validator:
+        return validator.validate_many(
+            [(item["assembly"], item.get("witnesses")) for item in items]
+        )
 
 
 if __name__ == "__main__":